@@ -0,0 +1,345 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import string
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+import yaml
+
+import rule_merger
+from rule_merger import RulesMerger
+
+logger = logging.getLogger('benchmark')
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+INPUT_FORMATS = ['text', 'yaml', 'json', 'mrs', 'srs', 'hosts', 'adblock', 'dnsmasq']
+# 各输入格式对应的上游 behavior，以及合并后序列化 / 编译的输出格式
+INPUT_BEHAVIORS = {
+    'text': 'classical',
+    'yaml': 'classical',
+    'json': 'sing-box',
+    'mrs': 'domain',
+    'srs': 'sing-box',
+    'hosts': 'domain',
+    'adblock': 'domain',
+    'dnsmasq': 'domain'
+}
+# 拦截列表格式的逐行写法，rule_merger 只读取不生成这些格式
+DOMAIN_LIST_LINES = {
+    'hosts': ('# hosts', '0.0.0.0 {}'),
+    'adblock': ('! adblock', '||{}^'),
+    'dnsmasq': ('# dnsmasq', 'address=/{}/')
+}
+OUTPUT_FORMATS = {
+    'classical': ['text', 'yaml'],
+    'domain': ['text', 'yaml', 'mrs'],
+    'sing-box': ['json', 'srs']
+}
+COMPILED_FORMATS = ('mrs', 'srs')
+SEED = 20240601
+TLDS = ['com', 'net', 'org', 'cn', 'io', 'dev', 'co.uk', 'com.cn']
+# 低于该耗时 (秒) 的差异视为噪声，不判定为性能回退
+MIN_REGRESSION_SECONDS = 0.01
+
+FAKE_MIHOMO = '''#!/bin/sh
+if [ "$1" = "-v" ]; then echo "Mihomo fake"; exit 0; fi
+# convert-ruleset <behavior> <format> <input> <output>
+cp "$4" "$5"
+'''
+FAKE_SING_BOX = '''#!/bin/sh
+if [ "$1" = "version" ]; then echo "sing-box version fake"; exit 0; fi
+# rule-set compile|decompile --output <output> <input>
+cp "$5" "$4"
+'''
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class Benchmark:
+    def __init__(self, work_dir: str, serve: str, fake_tools: bool, repeat: int):
+        self.work_dir = work_dir
+        self.serve = serve
+        self.repeat = repeat
+        self.upstream_dir = os.path.join(work_dir, 'upstream')
+        self.output_dir = os.path.join(work_dir, 'output')
+        os.makedirs(self.upstream_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.tool_paths = self._create_fake_tools() if fake_tools else {}
+        self.config_path = os.path.join(work_dir, 'config.yaml')
+        with open(self.config_path, 'w', encoding='utf-8') as f:
+            yaml.safe_dump([], f)
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.base_url = ''
+
+    def __enter__(self) -> 'Benchmark':
+        if self.serve == 'http':
+            handler = partial(QuietHandler, directory=self.upstream_dir)
+            self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            self.base_url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _create_fake_tools(self) -> Dict[str, str]:
+        """生成 mihomo / sing-box 替身，离线且无二进制时也能运行"""
+        bin_dir = os.path.join(self.work_dir, 'bin')
+        os.makedirs(bin_dir, exist_ok=True)
+        paths = {}
+        for name, script in (('mihomo', FAKE_MIHOMO), ('sing-box', FAKE_SING_BOX)):
+            path = os.path.join(bin_dir, name)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(script)
+            os.chmod(path, 0o755)
+            paths[name] = path
+        return paths
+
+    def new_merger(self) -> RulesMerger:
+        """创建使用独立缓存目录的 RulesMerger"""
+        merger = RulesMerger(self.config_path)
+        cache_dir = tempfile.mkdtemp(dir=self.work_dir)
+        merger.http_cache_dir = os.path.join(cache_dir, 'http')
+        merger.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        if self.tool_paths:
+            merger.mihomo_path = self.tool_paths['mihomo']
+            merger.sing_box_path = self.tool_paths['sing-box']
+        return merger
+
+    def generate_rules(self, size: int, behavior: str) -> List[str]:
+        """生成可复现的合成规则，包含重复与无效规则"""
+        rng = random.Random(f'{SEED}-{size}-{behavior}')
+        alphabet = string.ascii_lowercase + string.digits
+
+        def domain() -> str:
+            labels = [''.join(rng.choices(alphabet, k=rng.randint(4, 12))) for _ in range(rng.randint(1, 3))]
+            return '.'.join(labels + [rng.choice(TLDS)])
+
+        def cidr() -> str:
+            if rng.random() < 0.8:
+                prefix = rng.randint(8, 32)
+                return f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/{prefix}'
+            return f'2001:db8:{rng.randint(0, 0xffff):x}::/{rng.randint(32, 64)}'
+
+        rules = []
+        for _ in range(size):
+            roll = rng.random()
+            if behavior == 'domain':
+                rules.append(('+.' if roll < 0.6 else '') + domain())
+            elif roll < 0.45:
+                rules.append(f'DOMAIN-SUFFIX,{domain()}')
+            elif roll < 0.75:
+                rules.append(f'DOMAIN,{domain()}')
+            elif roll < 0.8:
+                rules.append(f"DOMAIN-KEYWORD,{''.join(rng.choices(string.ascii_lowercase, k=6))}")
+            elif roll < 0.98:
+                rules.append(f'IP-CIDR,{cidr()},no-resolve')
+            else:
+                rules.append(f'DOMAIN,invalid_{domain()}')
+        # 约 10% 的重复规则
+        rules.extend(rng.sample(rules, size // 10))
+        rng.shuffle(rules)
+        return rules
+
+    def prepare_upstream(self, size: int, rule_format: str) -> Optional[Dict[str, str]]:
+        """使用 rule_merger 自身的写入逻辑生成上游文件，返回规则源配置"""
+        behavior = INPUT_BEHAVIORS[rule_format]
+        name = f'{size}.{rule_format}'
+        path = os.path.join(self.upstream_dir, name)
+        rules_behavior = 'domain' if behavior == 'domain' else 'classical'
+        rules = self.generate_rules(size, rules_behavior)
+        if rule_format in DOMAIN_LIST_LINES:
+            self.write_domain_list(path, rules, rule_format)
+        elif behavior == 'sing-box':
+            if not self.write_sing_box_source(path, rules, rule_format):
+                logger.warning(f"无法生成上游文件, 跳过: {name}")
+                return None
+        elif not self.new_merger()._write_rules(path, rules, rule_format, rules_behavior):
+            logger.warning(f"无法生成上游文件, 跳过: {name}")
+            return None
+
+        source = {'format': rule_format, 'behavior': behavior}
+        if self.serve == 'http':
+            source.update(type='http', url=f'{self.base_url}/{name}')
+        else:
+            source.update(type='file', path=path)
+        return source
+
+    def write_sing_box_source(self, path: str, rules: List[str], rule_format: str) -> bool:
+        """每条规则生成一个带端口条件的 sing-box 规则对象，避免写入时被合并为少数几条规则"""
+        merger = self.new_merger()
+        rule_objects = []
+        for rule in rules:
+            converted = merger._to_sing_box_item(rule, 'classical')
+            if converted:
+                key, value = converted
+                rule_objects.append({key: [value], 'port': [443]})
+        version = rule_merger.SING_BOX_RULESET_VERSION
+        if rule_format == 'srs':
+            return merger._write_srs_file(path, rule_objects, version)
+        merger._dump_sing_box_source(path, rule_objects, version)
+        return True
+
+    def write_domain_list(self, path: str, rules: List[str], rule_format: str) -> None:
+        """按拦截列表格式逐行写出域名规则，suffix 规则去掉 +. 前缀"""
+        comment, template = DOMAIN_LIST_LINES[rule_format]
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(comment + '\n')
+            for rule in rules:
+                f.write(template.format(rule[2:] if rule.startswith('+.') else rule) + '\n')
+
+    def run_case(self, size: int, rule_format: str) -> List[Dict[str, Any]]:
+        """按阶段计时一个 (规模, 输入格式) 组合，重复多次取最小值"""
+        source = self.prepare_upstream(size, rule_format)
+        if source is None:
+            return []
+
+        best: Dict[str, Dict[str, Any]] = {}
+        for _ in range(self.repeat):
+            for stage, seconds, rule_count in self._run_stages(source):
+                if stage not in best or seconds < best[stage]['seconds']:
+                    best[stage] = {
+                        'size': size,
+                        'format': rule_format,
+                        'stage': stage,
+                        'seconds': round(seconds, 6),
+                        'rules': rule_count
+                    }
+        return list(best.values())
+
+    def _run_stages(self, source: Dict[str, str]) -> List[tuple]:
+        # 每个用例使用独立的 RulesMerger，结束时关闭其进程池
+        with self.new_merger() as merger:
+            return self._time_stages(merger, source)
+
+    def _time_stages(self, merger: RulesMerger, source: Dict[str, str]) -> List[tuple]:
+        behavior = source['behavior']
+        stages = []
+
+        def timed(stage: str, func: Callable[[], Any], count: Callable[[Any], int] = len) -> Any:
+            start = time.perf_counter()
+            result = func()
+            stages.append((stage, time.perf_counter() - start, count(result)))
+            return result
+
+        if source['type'] == 'http':
+            timed('fetch', lambda: merger._get_http_content(source['url']), lambda result: len(result[0]))
+        rules = timed('parse', lambda: list(merger._read_source(source)))
+
+        # 以解析结果替换读取步骤，单独测量清理、验证与格式转换
+        merger._read_source = lambda _source: rules
+        emitted = timed('transform', lambda: list(merger._emit_rules(
+            merger._iter_entries(source), behavior, behavior == 'sing-box'
+        )))
+        sorted_rules = timed('dedup', lambda: merger._collect_rules(emitted, behavior))
+
+        for output_format in OUTPUT_FORMATS[behavior]:
+            stage = 'compile' if output_format in COMPILED_FORMATS else 'serialize'
+            output_path = os.path.join(self.output_dir, f"{source['format']}.{output_format}")
+            timed(
+                f'{stage}:{output_format}',
+                lambda: merger._write_rules(output_path, sorted_rules, output_format, behavior),
+                lambda written: len(sorted_rules) if written else 0
+            )
+        return stages
+
+
+def compare_with_baseline(
+    results: List[Dict[str, Any]],
+    baseline: List[Dict[str, Any]],
+    threshold: float
+) -> List[Dict[str, Any]]:
+    """与基线结果比较，返回超过阈值的性能回退"""
+    baseline_index = {(item['size'], item['format'], item['stage']): item for item in baseline}
+    regressions = []
+    for item in results:
+        base = baseline_index.get((item['size'], item['format'], item['stage']))
+        if not base or base['seconds'] <= 0:
+            continue
+        ratio = item['seconds'] / base['seconds']
+        item['baseline_seconds'] = base['seconds']
+        item['ratio'] = round(ratio, 3)
+        if ratio > 1 + threshold and item['seconds'] - base['seconds'] > MIN_REGRESSION_SECONDS:
+            regressions.append(item)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rule_merger 合并流程基准测试')
+    parser.add_argument('-s', '--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='规则规模, 逗号分隔')
+    parser.add_argument('--formats', default=','.join(INPUT_FORMATS), help='上游格式, 逗号分隔')
+    parser.add_argument('--serve', choices=['http', 'file'], default='http', help='通过本地 HTTP 服务或文件读取上游')
+    parser.add_argument('--fake-tools', action='store_true', help='使用 mihomo / sing-box 替身')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='每个组合重复次数, 取最小耗时')
+    parser.add_argument('-o', '--output', help='结果 JSON 输出路径')
+    parser.add_argument('-b', '--baseline', help='基线结果 JSON 路径')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2, help='判定回退的耗时增长比例')
+    args = parser.parse_args()
+
+    logging.getLogger(rule_merger.__name__).setLevel(logging.WARNING)
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    formats = [rule_format for rule_format in args.formats.split(',') if rule_format]
+
+    results = []
+    work_dir = tempfile.mkdtemp(prefix='rule-merger-bench-')
+    try:
+        with Benchmark(work_dir, args.serve, args.fake_tools, args.repeat) as benchmark:
+            for size in sizes:
+                for rule_format in formats:
+                    for item in benchmark.run_case(size, rule_format):
+                        results.append(item)
+                        logger.info(
+                            f"{size:>9} {rule_format:<5} {item['stage']:<15} "
+                            f"{item['seconds']:>9.3f}s {item['rules']:>9}"
+                        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_with_baseline(results, json.load(f)['results'], args.threshold)
+        for item in regressions:
+            logger.warning(
+                f"性能回退: {item['size']} {item['format']} {item['stage']} "
+                f"{item['baseline_seconds']:.3f}s -> {item['seconds']:.3f}s (x{item['ratio']})"
+            )
+
+    if args.output:
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'serve': args.serve,
+                'fake_tools': args.fake_tools,
+                'repeat': args.repeat,
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+            },
+            'results': results,
+            'regressions': len(regressions)
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,51 @@
 import yaml
 import json
+import argparse
 import subprocess
 import tempfile
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import os
+import sys
+import io
 import logging
-from typing import List, Dict, Optional, Any
+import hashlib
+import gzip
+import pickle
+import struct
+import zlib
+import threading
+import multiprocessing
+import time
+import csv
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import List, Dict, Optional, Any, Iterable, Iterator, Callable
 import re
 import ipaddress
+import socket
+from functools import lru_cache
+from itertools import repeat, islice, chain, accumulate
+from array import array
+import heapq
+from operator import itemgetter
+from bisect import bisect_left
 from datetime import datetime
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # 配置日志
 logging.basicConfig(
@@ -16,10 +53,58 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-DOMAIN_PATTERN = re.compile(r'^[a-zA-Z0-9]([a-zA-Z0-9-]*[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9-]*[a-zA-Z0-9])?)*$')
 MIHOMO_PATH = 'mihomo'
 SING_BOX_PATH = 'sing-box'
 SING_BOX_RULESET_VERSION = 4
+# 并发获取上游规则的最大线程数
+FETCH_WORKERS = 8
+HTTP_TIMEOUT = 10
+# 并发生成输出文件的最大线程数，外部编译工具在独立进程中运行
+OUTPUT_WORKERS = os.cpu_count() or 1
+# 超过该大小 (字节) 的规则源按块分发到进程池清理、验证，设为 0 关闭
+LARGE_SOURCE_SIZE = 8 << 20
+PARSE_PROCESSES = os.cpu_count() or 1
+# 每个进程分到的块数，块越多负载越均衡，但进程间传输次数越多
+PARSE_CHUNKS_PER_PROCESS = 4
+# 输出在多个线程中并发生成，fork 多线程进程可能死锁 (Python 3.12 起已弃用)，进程池改用 forkserver / spawn 启动
+PARSE_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+# 持久化缓存目录，保存上游规则内容及 ETag / Last-Modified
+CACHE_DIR = os.environ.get('RULE_MERGER_CACHE_DIR', '.cache')
+# Python 3.12 起 cProfile 基于 sys.monitoring 采集所有线程，此前只采集启用它的线程
+PROFILE_ALL_THREADS = sys.version_info >= (3, 12)
+# 输出文件的增量文件后缀，记录相对上一版本新增、删除的规则
+DELTA_SUFFIX = '.delta.json'
+# 预压缩文件：Content-Encoding -> 文件后缀，按常驻模式下的协商优先级排列
+PRECOMPRESS_SUFFIXES = {
+    'br': '.br',
+    'zstd': '.zst',
+    'gzip': '.gz'
+}
+# 仅为文本格式生成预压缩文件，mrs / srs 本身已压缩
+PRECOMPRESS_FORMATS = ('yaml', 'text', 'json')
+GZIP_COMPRESSION_LEVEL = 9
+BROTLI_QUALITY = 11
+ZSTD_COMPRESSION_LEVEL = 22
+# HTTP 的 zstd 编码要求窗口不超过 8 MiB (RFC 9659)，否则浏览器拒绝解码
+ZSTD_WINDOW_LOG = 23
+# 常驻模式下规则源的默认刷新间隔 (秒)，可在规则源中用 interval 单独配置
+DAEMON_REFRESH_INTERVAL = 3600
+DAEMON_HOST = '127.0.0.1'
+DAEMON_PORT = 8080
+OUTPUT_CONTENT_TYPES = {
+    'yaml': 'text/yaml; charset=utf-8',
+    'text': 'text/plain; charset=utf-8',
+    'json': 'application/json; charset=utf-8',
+    'mrs': 'application/octet-stream',
+    'srs': 'application/octet-stream'
+}
+# 域名、CIDR 的验证结果在进程内跨规则源、输出文件复用；缓存同时持有规则字符串，容量过大会显著抬高内存峰值
+VALIDATION_CACHE_SIZE = 1 << 16
+# libyaml 可用时使用 C 实现的解析器
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+# 可按原样输出为 YAML plain scalar 的规则，其余规则交由 yaml.dump 处理引号
+YAML_PLAIN_PATTERN = re.compile(r'^[A-Za-z0-9+._/][A-Za-z0-9+._/,:=@-]*$')
+YAML_PAYLOAD_ITEM_PATTERN = re.compile(r'^\s*- (.*)$')
 SING_BOX_LIST_FIELDS = (
     'domain',
     'domain_suffix',
@@ -27,26 +112,773 @@ SING_BOX_LIST_FIELDS = (
     'domain_regex',
     'ip_cidr'
 )
+# srs 二进制规则集，格式与 sing-box common/srs 保持一致
+SRS_MAGIC = b'SRS'
+SRS_RULE_ITEMS = (
+    ('network', 1, 'string'),
+    ('domain', 2, 'domain'),
+    ('domain_keyword', 3, 'string'),
+    ('domain_regex', 4, 'string'),
+    ('source_ip_cidr', 5, 'ip'),
+    ('ip_cidr', 6, 'ip'),
+    ('source_port', 7, 'uint16'),
+    ('source_port_range', 8, 'string'),
+    ('port', 9, 'uint16'),
+    ('port_range', 10, 'string'),
+    ('process_name', 11, 'string'),
+    ('process_path', 12, 'string'),
+    ('package_name', 13, 'string'),
+    ('wifi_ssid', 14, 'string'),
+    ('wifi_bssid', 15, 'string'),
+    ('process_path_regex', 17, 'string')
+)
+SRS_ITEM_FINAL = 0xFF
+SRS_DOMAIN_SUFFIX_LABEL = '\r'
+SRS_DOMAIN_ROOT_LABEL = '\n'
+# 生成 srs / mrs 后校验原生编码结果并与 sing-box / mihomo 的解码比对，不一致时保留原文件并以非零状态退出
+# 设置环境变量 RULE_MERGER_VERIFY=1 开启 (GitHub Actions 中开启)
+VERIFY_COMPILED = os.environ.get('RULE_MERGER_VERIFY', '') not in ('', '0')
+SRS_VERIFY = VERIFY_COMPILED
+# mrs 二进制规则集，格式与 mihomo rules/provider 保持一致
+MRS_MAGIC = b'MRS\x01'
+MRS_BEHAVIORS = {'domain': 0, 'ipcidr': 1}
+MRS_COMPRESSION_LEVEL = 19
+MRS_VERIFY = VERIFY_COMPILED
+# 规范规则条目类型沿用 sing-box 字段名，另有仅适用于单一目标格式的原样规则
+CLASSICAL_TO_SING_BOX = {
+    'DOMAIN': 'domain',
+    'DOMAIN-SUFFIX': 'domain_suffix',
+    'DOMAIN-KEYWORD': 'domain_keyword',
+    'DOMAIN-REGEX': 'domain_regex',
+    'IP-CIDR': 'ip_cidr',
+    'IP-CIDR6': 'ip_cidr'
+}
+# 仅包含域名的拦截列表格式，按固定位置扫描提取域名，输出 domain / domain_suffix 条目
+DOMAIN_LIST_FORMATS = ('hosts', 'adblock', 'dnsmasq')
+# hosts 文件中指向本机的条目，不作为规则
+HOSTS_IGNORED_NAMES = frozenset({
+    'localhost',
+    'localhost.localdomain',
+    'local',
+    'broadcasthost',
+    'ip6-localhost',
+    'ip6-loopback',
+    'ip6-localnet',
+    'ip6-mcastprefix',
+    'ip6-allnodes',
+    'ip6-allrouters',
+    'ip6-allhosts',
+    '0.0.0.0'
+})
+# AdBlock 规则仅保留不缩小匹配范围的修饰符，带有其他修饰符 (如 $third-party、$denyallow) 的规则整条丢弃
+ADBLOCK_MODIFIERS = frozenset({'important', 'all', 'document', 'doc'})
+# dnsmasq 中按域名 (含子域名) 返回指定地址的配置项；server=/ 与 local=/ 为转发配置，不是拦截规则
+DNSMASQ_BLOCK_DIRECTIVE = 'address=/'
+# dnsmasq address=/ 的目标为空或 # 时返回 NXDOMAIN 或未指定地址，同样表示拦截
+DNSMASQ_BLOCK_TARGETS = frozenset({'', '#'})
+SING_BOX_TO_CLASSICAL = {
+    'domain': 'DOMAIN',
+    'domain_suffix': 'DOMAIN-SUFFIX',
+    'domain_keyword': 'DOMAIN-KEYWORD',
+    'domain_regex': 'DOMAIN-REGEX',
+    'ip_cidr': 'IP-CIDR'
+}
+
+
+class DomainSuffixTrie:
+    """以反转标签存储域名后缀的前缀树，用于判断域名是否被更宽泛的后缀覆盖，后缀节点可附带值"""
+
+    _END = ''
+
+    def __init__(self, suffixes: Iterable[str] = (), root: Optional[Dict[str, Any]] = None):
+        self._root: Dict[str, Any] = root if root is not None else {}
+        for suffix in suffixes:
+            self.add(suffix)
+
+    def add(self, suffix: str, value: Any = None) -> None:
+        node = self._root
+        for label in reversed(suffix.lower().split('.')):
+            node = node.setdefault(label, {})
+        if value is None:
+            node.setdefault(self._END, [])
+        else:
+            node.setdefault(self._END, []).append(value)
+
+    def match(self, domain: str) -> List[Any]:
+        """返回覆盖 domain 的所有后缀 (含自身) 附带的值，由上层后缀到下层后缀"""
+        values = []
+        node = self._root
+        for label in reversed(domain.lower().split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            values.extend(node.get(self._END, ()))
+        return values
+
+    def covers(self, domain: str, include_self: bool = True) -> bool:
+        """domain 是否被某个后缀覆盖；include_self 为 False 时只匹配更上层的后缀"""
+        node = self._root
+        labels = domain.lower().split('.')
+        for index in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[index])
+            if node is None:
+                return False
+            if self._END in node and (index > 0 or include_self):
+                return True
+        return False
+
+
+class KeywordAutomaton:
+    """关键词的 Aho-Corasick 自动机，一次线性扫描判断文本是否包含任一关键词"""
+
+    def __init__(self, keywords: Iterable[str] = ()):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._match: List[bool] = [False]
+        # 以该状态结尾的关键词，及沿失配链最近的另一个结尾状态，用于列出全部命中的关键词
+        self._words: List[Optional[str]] = [None]
+        self._output: List[int] = [0]
+        for keyword in keywords:
+            if keyword:
+                self._add(keyword.lower())
+        self._build()
+
+    def __len__(self) -> int:
+        return sum(word is not None for word in self._words)
+
+    def _add(self, keyword: str) -> None:
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._match.append(False)
+                self._words.append(None)
+                self._output.append(0)
+            state = next_state
+        self._match[state] = True
+        self._words[state] = keyword
+
+    def _build(self) -> None:
+        """按层序计算失配指针，并沿失配链合并匹配标记"""
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._match[next_state] = self._match[next_state] or self._match[fail]
+                self._output[next_state] = fail if self._words[fail] is not None else self._output[fail]
+
+    def search(self, text: str) -> bool:
+        goto, fail, match = self._goto, self._fail, self._match
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if match[state]:
+                return True
+        return False
+
+    def find_all(self, text: str) -> List[str]:
+        """返回 text 中出现的所有关键词 (去重)"""
+        goto, fail, words, output = self._goto, self._fail, self._words, self._output
+        found = set()
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            matched = state if words[state] is not None else output[state]
+            while matched:
+                found.add(words[matched])
+                matched = output[matched]
+        return sorted(found)
+
+
+class RuleIndex:
+    """按规则集合 (输出文件或规则源) 建立的查询索引：精确域名、后缀前缀树、按前缀长度分组的 CIDR、关键词自动机及正则"""
+
+    def __init__(self, state: Optional[Dict[str, Any]] = None):
+        state = state or {}
+        # 规则集合的描述，值中的集合编号即其下标
+        self.sets: List[Dict[str, Any]] = state.get('sets', [])
+        self._domains: Dict[str, List[tuple]] = state.get('domains', {})
+        self._suffixes = DomainSuffixTrie(root=state.get('suffixes'))
+        # (IP 版本, 前缀长度, 网络地址) -> 命中值；CIDR 之间只有包含或不相交，点查询按前缀长度逐一查找即可
+        self._cidrs: Dict[tuple[int, int, int], List[tuple]] = state.get('cidrs', {})
+        self._keywords: Dict[str, List[tuple]] = state.get('keywords', {})
+        self._regexes: Dict[str, List[tuple]] = state.get('regexes', {})
+        self._build_matchers()
+
+    def state(self) -> Dict[str, Any]:
+        """仅由内置类型组成的索引内容，用于持久化"""
+        return {
+            'sets': self.sets,
+            'domains': self._domains,
+            'suffixes': self._suffixes._root,
+            'cidrs': self._cidrs,
+            'keywords': self._keywords,
+            'regexes': self._regexes
+        }
+
+    def _build_matchers(self) -> None:
+        self._prefix_lengths = {
+            version: sorted({length for item_version, length, _ in self._cidrs if item_version == version})
+            for version in (4, 6)
+        }
+        self._automaton = KeywordAutomaton(self._keywords)
+        self._compiled_regexes = []
+        for pattern, values in self._regexes.items():
+            try:
+                self._compiled_regexes.append((re.compile(pattern), values))
+            except re.error:
+                continue
+
+    def add_set(self, **description: Any) -> int:
+        self.sets.append(description)
+        return len(self.sets) - 1
+
+    def add(self, kind: str, value: str, rule: str, set_id: int) -> None:
+        item = (rule, set_id)
+        if kind == 'domain':
+            self._domains.setdefault(value.lower(), []).append(item)
+        elif kind == 'domain_suffix':
+            self._suffixes.add(value, item)
+        elif kind == 'domain_keyword':
+            self._keywords.setdefault(value.lower(), []).append(item)
+        elif kind == 'domain_regex':
+            self._regexes.setdefault(value, []).append(item)
+        elif kind == 'ip_cidr':
+            ip_range = parse_cidr(value)
+            if ip_range:
+                version, start, end = ip_range
+                length = (32 if version == 4 else 128) - (end - start).bit_length()
+                self._cidrs.setdefault((version, length, start), []).append(item)
+
+    def finish(self) -> None:
+        self._build_matchers()
+
+    def query(self, text: str) -> List[tuple]:
+        """返回命中 text (域名、IP 或 CIDR) 的 (规则, 集合编号)"""
+        ip_range = parse_cidr(text) if ':' in text or text.replace('.', '').replace('/', '').isdigit() else None
+        if ip_range:
+            return self._query_ip(*ip_range)
+
+        domain = text.lower().rstrip('.')
+        matches = list(self._domains.get(domain, ()))
+        matches.extend(self._suffixes.match(domain))
+        for keyword in self._automaton.find_all(domain):
+            matches.extend(self._keywords[keyword])
+        for regex, values in self._compiled_regexes:
+            if regex.search(domain):
+                matches.extend(values)
+        return matches
+
+    def _query_ip(self, version: int, start: int, end: int) -> List[tuple]:
+        bits = 32 if version == 4 else 128
+        query_length = bits - (end - start).bit_length()
+        matches = []
+        for length in self._prefix_lengths[version]:
+            if length > query_length:
+                break
+            network = start >> (bits - length) << (bits - length)
+            matches.extend(self._cidrs.get((version, length, network), ()))
+        return matches
+
+
+class PackedRuleSet:
+    """排序、去重的字符串规则集合：规则按 UTF-8 编码、以换行结尾存入一块连续缓冲区，另以偏移数组随机访问"""
+
+    # 批量插入时每批规则数，峰值内存只包含一批 str 对象
+    BATCH_SIZE = 1 << 18
+    # 顺序遍历时每次解码的规则数
+    BLOCK_SIZE = 1 << 14
+
+    def __init__(self, data: bytes = b'', offsets: Optional[array] = None):
+        self._data = data
+        # offsets[i] 为第 i 条规则的起始位置，末尾追加缓冲区长度
+        self._offsets = offsets if offsets is not None else array('Q', [0])
+
+    @classmethod
+    def build(cls, rules: Iterable[str]) -> 'PackedRuleSet':
+        """批量插入：逐批去重排序为有序块，再归并为一个集合"""
+        iterator = iter(rules)
+        runs = []
+        while True:
+            batch = set(islice(iterator, cls.BATCH_SIZE))
+            if not batch:
+                break
+            runs.append(cls.from_sorted(sorted(batch)))
+            del batch
+        return cls.merge(runs)
+
+    @classmethod
+    def from_sorted(cls, rules: Iterable[str]) -> 'PackedRuleSet':
+        """由已排序、去重的规则构建"""
+        chunks = []
+        offsets = array('Q', [0])
+        iterator = iter(rules)
+        while True:
+            block = list(islice(iterator, cls.BLOCK_SIZE))
+            if not block:
+                break
+            chunk = ('\n'.join(block) + '\n').encode('utf-8')
+            # 纯 ASCII 时字节长度即字符长度，无需逐条编码
+            lengths = (len(rule) + 1 for rule in block) if chunk.isascii() else (
+                len(rule.encode('utf-8')) + 1 for rule in block
+            )
+            # 以上一块的结束位置为起点累加，替换末尾重复的起点
+            offsets.extend(accumulate(lengths, initial=offsets.pop()))
+            chunks.append(chunk)
+        return cls(b''.join(chunks), offsets)
+
+    @classmethod
+    def merge(cls, runs: List['PackedRuleSet']) -> 'PackedRuleSet':
+        """多路归并若干有序集合，相同规则只保留一条"""
+        if not runs:
+            return cls()
+        if len(runs) == 1:
+            return runs[0]
+        data = bytearray()
+        offsets = array('Q', [0])
+        previous = None
+        # 去掉行尾换行后再比较，保证与 str 排序一致
+        strip_newline = itemgetter(slice(0, -1))
+        for rule in heapq.merge(*(map(strip_newline, io.BytesIO(run._data)) for run in runs)):
+            if rule != previous:
+                data += rule
+                data += b'\n'
+                offsets.append(len(data))
+                previous = rule
+        return cls(bytes(data), offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._data[self._offsets[index]:self._offsets[index + 1] - 1].decode('utf-8')
+
+    def __contains__(self, rule: object) -> bool:
+        """按字节序二分查找，UTF-8 字节序与 str 的码位序一致"""
+        if not isinstance(rule, str):
+            return False
+        key = rule.encode('utf-8')
+        data, offsets = self._data, self._offsets
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            value = data[offsets[middle]:offsets[middle + 1] - 1]
+            if value < key:
+                low = middle + 1
+            elif value > key:
+                high = middle
+            else:
+                return True
+        return False
+
+    def __iter__(self) -> Iterator[str]:
+        for block in self.iter_text():
+            yield from block[:-1].split('\n')
+
+    def iter_text(self) -> Iterator[str]:
+        """按块解码，每块为若干条以换行结尾的规则，写入文件时无需逐条处理"""
+        offsets = self._offsets
+        for start in range(0, len(self), self.BLOCK_SIZE):
+            end = min(start + self.BLOCK_SIZE, len(self))
+            yield self._data[offsets[start]:offsets[end]].decode('utf-8')
+
+    def joined(self) -> memoryview:
+        """与 '\\n'.join(rules) 相同的 UTF-8 内容"""
+        return memoryview(self._data)[:-1] if self._data else memoryview(b'')
+
+
+class SingBoxRule(tuple):
+    """不可变、可哈希的 sing-box headless rule：按字段名排序的 (字段, 值) 对，列表冻结为元组，嵌套规则同样冻结"""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, rule: Dict[str, Any]) -> 'SingBoxRule':
+        return cls(sorted((key, cls._freeze(value)) for key, value in rule.items()))
+
+    @classmethod
+    def from_pairs(cls, pairs: List[tuple]) -> 'SingBoxRule':
+        """json.loads 的 object_pairs_hook，解析时直接生成冻结规则，嵌套对象已由内层调用冻结"""
+        return cls(sorted(
+            (key, cls._freeze(value) if isinstance(value, list) else value)
+            for key, value in dict(pairs).items()
+        ))
+
+    @classmethod
+    def _freeze(cls, value: Any) -> Any:
+        if isinstance(value, dict):
+            return cls.from_dict(value)
+        if isinstance(value, list):
+            return tuple(cls._freeze(item) if isinstance(item, (dict, list)) else item for item in value)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        for item_key, value in self:
+            if item_key == key:
+                return value
+        return default
+
+    def to_dict(self) -> Dict[str, Any]:
+        """还原为 dict；列表字段保留为元组，json 与 srs 编码均按列表处理"""
+        rule = dict(self)
+        for key, value in self:
+            if isinstance(value, SingBoxRule):
+                rule[key] = value.to_dict()
+            elif isinstance(value, tuple) and value and isinstance(value[0], SingBoxRule):
+                rule[key] = [item.to_dict() if isinstance(item, SingBoxRule) else item for item in value]
+        return rule
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+    def sort_key(self) -> str:
+        """输出排序键，由 C 实现的 tuple repr 生成，避免逐条序列化 JSON"""
+        return tuple.__repr__(self)
+
+
+class RunReport:
+    """记录规则源、输出文件各阶段的耗时、字节数、规则数与内存峰值"""
+
+    FIELDS = [
+        'kind', 'name', 'stage', 'seconds', 'bytes',
+        'rules_in', 'rules_kept', 'rules_rejected', 'peak_memory'
+    ]
+
+    def __init__(self):
+        self._records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        # 正在进行的阶段，包括嵌套阶段及其他线程中的阶段
+        self._active: Dict[int, Dict[str, Any]] = {}
+
+    @contextmanager
+    def stage(self, kind: str, name: str, stage: str) -> Iterator[Dict[str, Any]]:
+        """计时一个阶段；开启 tracemalloc 时记录阶段内的进程内存峰值，外层阶段包含嵌套阶段的峰值，并发阶段的峰值互相重叠"""
+        record = {'kind': kind, 'name': name, 'stage': stage}
+        with self._lock:
+            self._collect_peak()
+            self._active[id(record)] = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 6)
+            with self._lock:
+                self._collect_peak()
+                del self._active[id(record)]
+                self._records.append(record)
+
+    def _collect_peak(self) -> None:
+        """tracemalloc 只有一个全局峰值：每个阶段开始、结束时将上一区间的峰值计入所有进行中的阶段再重置"""
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        for record in self._active.values():
+            record['peak_memory'] = max(record.get('peak_memory', 0), peak)
+
+    def write(self, path: str) -> None:
+        """按扩展名写出 CSV 或 JSON 报告"""
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            if path.endswith('.csv'):
+                writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+                writer.writeheader()
+                writer.writerows(self._records)
+                return
+            json.dump({
+                'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'stages': self._records
+            }, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+
+
+class OutputServer(ThreadingHTTPServer):
+    """常驻模式下提供输出文件的 HTTP 服务，内容与 ETag 保存在内存中"""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int]):
+        super().__init__(address, OutputRequestHandler)
+        # url 路径 -> (内容, ETag, Last-Modified, Content-Type)
+        self.outputs: Dict[str, tuple[bytes, str, str, str]] = {}
+        self.lock = threading.Lock()
+
+    def publish(self, url_path: str, content: bytes, mtime: float, content_type: str) -> None:
+        etag = '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+        with self.lock:
+            self.outputs[url_path] = (content, etag, formatdate(mtime, usegmt=True), content_type)
+
+    def unpublish(self, url_path: str) -> None:
+        with self.lock:
+            self.outputs.pop(url_path, None)
+
+    def lookup(self, url_path: str) -> Optional[tuple[bytes, str, str, str]]:
+        with self.lock:
+            return self.outputs.get(url_path)
+
+
+class OutputRequestHandler(BaseHTTPRequestHandler):
+    server: OutputServer
+
+    def do_HEAD(self) -> None:
+        self._send_output(with_body=False)
+
+    def do_GET(self) -> None:
+        self._send_output(with_body=True)
+
+    def _send_output(self, with_body: bool) -> None:
+        url_path = self.path.split('?', 1)[0]
+        output = self.server.lookup(url_path)
+        if output is None:
+            self.send_error(404)
+            return
+        content, etag, last_modified, content_type = output
+        encoding, compressed = self._negotiate_encoding(url_path)
+        if compressed is not None:
+            content, etag, last_modified, _ = compressed
+
+        if_none_match = self.headers.get('If-None-Match', '')
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        if etag in tags or '*' in tags:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        if with_body:
+            self.wfile.write(content)
+
+    def _negotiate_encoding(self, url_path: str) -> tuple[Optional[str], Optional[tuple[bytes, str, str, str]]]:
+        """按 Accept-Encoding 选择已发布的预压缩文件，均不可用时返回原文件"""
+        accepted = set()
+        for token in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = token.partition(';')
+            quality = params.strip().removeprefix('q=')
+            try:
+                if quality and float(quality) == 0:
+                    continue
+            except ValueError:
+                continue
+            accepted.add(name.strip().lower())
+
+        for encoding, suffix in PRECOMPRESS_SUFFIXES.items():
+            if encoding in accepted:
+                compressed = self.server.lookup(url_path + suffix)
+                if compressed is not None:
+                    return encoding, compressed
+        return None, None
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.getLogger(__name__).debug(f"{self.address_string()} - {format % args}")
+
+
+class BinaryReader:
+    """按 Go encoding/binary 的约定顺序读取字节"""
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self._pos = 0
+
+    def read(self, size: int) -> bytes:
+        end = self._pos + size
+        if end > len(self._data):
+            raise ValueError("数据意外结束")
+        chunk = self._data[self._pos:end]
+        self._pos = end
+        return chunk
+
+    def read_byte(self) -> int:
+        return self.read(1)[0]
+
+    def read_uvarint(self) -> int:
+        value = 0
+        shift = 0
+        while True:
+            byte = self.read_byte()
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+            if shift > 63:
+                raise ValueError("uvarint 溢出")
+
+    def read_uint64(self) -> int:
+        return struct.unpack('>Q', self.read(8))[0]
+
+    def read_bytes(self) -> bytes:
+        return self.read(self.read_uvarint())
+
+
+def encode_uvarint(value: int) -> bytes:
+    buffer = bytearray()
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+    return bytes(buffer)
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def is_valid_domain(domain: str) -> bool:
+    """逐标签线性检查域名：仅含 ASCII 字母、数字、连字符，标签非空且不以连字符开头或结尾"""
+    if not domain.isascii() or not domain.replace('-', '').replace('.', '').isalnum():
+        return False
+    return not (
+        domain[0] in '.-' or domain[-1] in '.-' or
+        '..' in domain or '.-' in domain or '-.' in domain
+    )
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def parse_cidr(cidr: str) -> Optional[tuple[int, int, int]]:
+    """解析 CIDR 为 (版本, 起始地址, 结束地址)，常见写法直接解析，其余交给 ipaddress"""
+    address, slash, prefix = cidr.partition('/')
+    if slash and not (prefix.isascii() and prefix.isdigit()) or '%' in address:
+        return _parse_cidr_with_ipaddress(cidr)
+
+    # inet_pton 与 ipaddress 同样拒绝前导零、缩写等不规范写法，无法解析时再交给 ipaddress 判定
+    family, version, bits = (socket.AF_INET6, 6, 128) if ':' in address else (socket.AF_INET, 4, 32)
+    try:
+        value = int.from_bytes(socket.inet_pton(family, address), 'big')
+    except (OSError, ValueError):
+        return _parse_cidr_with_ipaddress(cidr)
+
+    prefix_length = int(prefix) if slash else bits
+    if prefix_length > bits:
+        return None
+    host_mask = (1 << (bits - prefix_length)) - 1
+    start = value & ~host_mask
+    return version, start, start | host_mask
+
+
+def _parse_cidr_with_ipaddress(cidr: str) -> Optional[tuple[int, int, int]]:
+    try:
+        network = ipaddress.ip_network(cidr, strict=False)
+    except ValueError:
+        return None
+    start = int(network.network_address)
+    return network.version, start, start + network.num_addresses - 1
+
+
+def is_sinkhole_address(address: str) -> bool:
+    """拦截列表中表示屏蔽的地址：未指定地址 (0.0.0.0、::) 或本机回环地址"""
+    if '/' in address:
+        return False
+    parsed = parse_cidr(address)
+    if parsed is None:
+        return False
+    version, start, _ = parsed
+    return start == 0 or (start >> 24 == 127 if version == 4 else start == 1)
+
+
+@lru_cache(maxsize=None)
+def script_digest() -> str:
+    """脚本自身的 SHA-256，运行期间不会变化，每个进程只计算一次"""
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# 生成输出文件的工作线程在此暂存日志，由主线程按配置顺序输出；过滤器只在模块加载时注册一次
+_log_buffer = threading.local()
+
+
+def _buffer_log_record(record: logging.LogRecord) -> bool:
+    records = getattr(_log_buffer, 'records', None)
+    if records is None:
+        return True
+    records.append(record)
+    return False
+
+
+logging.getLogger(__name__).addFilter(_buffer_log_record)
+
+_chunk_merger: Optional['RulesMerger'] = None
+
+
+def parse_entries_chunk(chunk: Any, rule_format: str, behavior: str) -> tuple[List[tuple], int, int]:
+    """进程池工作函数：清理、验证一块规则 (按行文本内容或规则列表)，返回块内去重后的条目、读取规则数及验证失败数"""
+    global _chunk_merger
+    if _chunk_merger is None:
+        _chunk_merger = RulesMerger()
+    rules = _chunk_merger._iter_lines(io.BytesIO(chunk)) if isinstance(chunk, bytes) else chunk
+    counts = [0, 0]
+    entries = list(dict.fromkeys(_chunk_merger._parse_rules(rules, rule_format, behavior, counts)))
+    return entries, counts[0], counts[1]
 
 
 class RulesMerger:
-    def __init__(self, config_path: str):
+    def __init__(self, config_path: Optional[str] = None):
         self.logger = logging.getLogger(__name__)
-        self.config = self._load_config(config_path)
+        # 不指定配置文件时仅用于解析规则，如进程池中的工作进程
+        self.config = self._load_config(config_path) if config_path else []
         self.mihomo_path = MIHOMO_PATH
         self.sing_box_path = SING_BOX_PATH
-        self._transformers = {
-            ('classical', 'ipcidr'): self._classical_to_ipcidr,
-            ('classical', 'domain'): self._classical_to_domain,
-            ('ipcidr', 'classical'): self._ipcidr_to_classical,
-            ('domain', 'classical'): self._domain_to_classical,
-            ('classical', 'sing-box'): self._classical_to_sing_box,
-            ('domain', 'sing-box'): self._domain_to_sing_box,
-            ('ipcidr', 'sing-box'): self._ipcidr_to_sing_box,
-            ('sing-box', 'classical'): self._sing_box_to_classical,
-            ('sing-box', 'domain'): self._sing_box_to_domain,
-            ('sing-box', 'ipcidr'): self._sing_box_to_ipcidr
-        }
+        # 单次运行内的规则源缓存，同一上游被多个输出共享时只获取、解析验证一次
+        self._entries_cache: Dict[tuple, List[tuple]] = {}
+        # 缓存引用计数，最后一个使用者取用后立即释放缓存
+        self._entries_refs: Dict[tuple, int] = {}
+        self._cache_lock = threading.Lock()
+        self._key_locks: Dict[tuple, threading.Lock] = {}
+        self.output_workers = OUTPUT_WORKERS
+        self.fetch_workers = FETCH_WORKERS
+        self.parse_processes = PARSE_PROCESSES
+        self.large_source_size = LARGE_SOURCE_SIZE
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self.http_cache_dir = os.path.join(CACHE_DIR, 'http')
+        self.manifest_path = os.path.join(CACHE_DIR, 'manifest.json')
+        self.lookup_index_path = os.path.join(CACHE_DIR, 'lookup-index.pickle')
+        self.output_state_dir = os.path.join(CACHE_DIR, 'outputs')
+        self._http_content_cache: Dict[str, Optional[tuple[bytes, str]]] = {}
+        # 本次运行中仍需解析各 url 内容的规则源数，归零后释放内存中的内容 (常驻模式保留)
+        self._http_content_refs: Dict[str, int] = {}
+        # 为 True 时 http 规则源直接使用本地缓存，缓存缺失时才请求上游 (查询索引默认如此)
+        self.prefer_http_cache = False
+        self._tool_versions: Dict[str, Optional[str]] = {}
+        self._session = self._create_session()
+        # 运行报告与性能分析，仅在命令行开启时记录
+        self.report: Optional[RunReport] = None
+        self.profile_path: Optional[str] = None
+        self._profiles: List[cProfile.Profile] = []
+        # 常驻模式下跨轮次保留解析结果：规则源缓存键 -> (内容摘要, 规则条目)
+        self.resident = False
+        self.refresh_interval = DAEMON_REFRESH_INTERVAL
+        self._resident_entries: Dict[tuple, tuple[Optional[str], List[tuple]]] = {}
+        # 原生编码的 srs / mrs 校验失败的输出文件
+        self.verify_failures: List[str] = []
+
+    def __enter__(self) -> 'RulesMerger':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._shutdown_process_pool()
 
     def _load_config(self, path: str) -> dict:
         """加载配置文件"""
@@ -60,157 +892,251 @@ class RulesMerger:
             self.logger.error(f"配置文件解析失败: {e}")
             raise
 
+    def _create_session(self) -> requests.Session:
+        """创建带连接池的共享会话，复用同一主机的 keep-alive 连接"""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.fetch_workers,
+            pool_maxsize=self.fetch_workers
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
     def _make_temp_path(self, suffix: str) -> str:
         """创建临时文件路径并立即关闭句柄，方便外部工具读写。"""
         fd, path = tempfile.mkstemp(suffix=suffix)
         os.close(fd)
         return path
     
-    def _fetch_http_rules(self, url: str, rule_format: str, behavior: str = 'classical') -> List[str]:
-        """获取在线规则"""
+    def _http_cache_paths(self, url: str) -> tuple[str, str]:
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.http_cache_dir, name)
+        return base + '.body', base + '.json'
+
+    def _load_http_cache(self, url: str) -> Optional[Dict[str, Any]]:
+        """读取上游规则的本地缓存，缓存缺失或损坏时返回 None"""
+        body_path, meta_path = self._http_cache_paths(url)
         try:
-            response = requests.get(url, timeout=10)
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return None
+
+        if hashlib.sha256(content).hexdigest() != meta.get('sha256'):
+            self.logger.warning(f"缓存内容校验失败, 忽略缓存: {url}")
+            return None
+        meta['content'] = content
+        return meta
+
+    def _save_http_cache(self, url: str, content: bytes, headers: Any) -> None:
+        body_path, meta_path = self._http_cache_paths(url)
+        meta = {
+            'url': url,
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'content_type': headers.get('content-type', ''),
+            'sha256': hashlib.sha256(content).hexdigest()
+        }
+        try:
+            os.makedirs(self.http_cache_dir, exist_ok=True)
+            self._atomic_write(body_path, content)
+            self._atomic_write(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        except OSError as e:
+            self.logger.warning(f"写入缓存失败 {url}: {e}")
+
+    def _atomic_write(self, path: str, data: bytes) -> None:
+        """先写临时文件再替换，避免中断时留下不完整的文件"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _stage(self, kind: str, name: str, stage: str):
+        """开启运行报告时计时一个阶段，否则返回一次性的空记录"""
+        if self.report is None:
+            return nullcontext({})
+        return self.report.stage(kind, name, stage)
+
+    def _profiled(self, func: Callable, worker: bool = True) -> Callable:
+        """开启性能分析时采集 cProfile 数据，旧版本 Python 需要在工作线程内分别采集"""
+        if not self.profile_path or (worker and PROFILE_ALL_THREADS):
+            return func
+
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self._cache_lock:
+                    self._profiles.append(profile)
+        return wrapper
+
+    def _save_profile(self) -> None:
+        stats = pstats.Stats(self._profiles[0])
+        for profile in self._profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.profile_path)
+        self.logger.info(f"已生成性能分析文件: {self.profile_path}")
+
+    def _fetch_http_content(self, url: str, record: Optional[Dict[str, Any]] = None) -> Optional[tuple[bytes, str]]:
+        """获取上游内容，支持条件请求；上游异常时回退到最近一次成功的缓存"""
+        cached = self._load_http_cache(url)
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        try:
+            response = self._session.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+            if response.status_code == 304 and cached:
+                self.logger.info(f"上游未变更, 使用缓存: {url}")
+                return cached['content'], cached.get('content_type', '')
             response.raise_for_status()
+        except Exception as e:
+            if cached:
+                self.logger.warning(f"获取规则失败, 使用缓存 {url}: {str(e)}")
+                return cached['content'], cached.get('content_type', '')
+            self.logger.error(f"获取规则失败 {url}: {str(e)}", exc_info=True)
+            return None
+
+        self._save_http_cache(url, response.content, response.headers)
+        if record is not None:
+            record['bytes'] = len(response.content)
+        return response.content, response.headers.get('content-type', '')
+
+    def _get_http_content(self, url: str) -> Optional[tuple[bytes, str]]:
+        """获取上游内容，同一 url 在单次运行内只请求一次"""
+        if url not in self._http_content_cache and self.prefer_http_cache:
+            cached = self._load_http_cache(url)
+            if cached:
+                self._http_content_cache[url] = (cached['content'], cached.get('content_type', ''))
+        if url not in self._http_content_cache:
+            with self._stage('source', url, 'fetch') as record:
+                record['bytes'] = 0
+                self._http_content_cache[url] = self._fetch_http_content(url, record)
+        return self._http_content_cache[url]
+
+    def _take_http_content(self, url: str) -> Optional[tuple[bytes, str]]:
+        """获取上游内容用于解析，最后一个规则源取走后不再保留在内存中"""
+        fetched = self._get_http_content(url)
+        with self._cache_lock:
+            if url in self._http_content_refs:
+                self._http_content_refs[url] -= 1
+                if self._http_content_refs[url] <= 0:
+                    del self._http_content_refs[url]
+                    self._http_content_cache.pop(url, None)
+        return fetched
+
+    def _fetch_http_rules(self, url: str, rule_format: str, behavior: str = 'classical') -> Iterable[str]:
+        """获取在线规则，text 格式逐行惰性返回"""
+        fetched = self._take_http_content(url)
+        if fetched is None:
+            return []
+        content, content_type = fetched
 
+        try:
             if rule_format == 'json':
-                return self._read_sing_box_source(response.text)
+                return self._read_sing_box_source(content.decode('utf-8', errors='replace'))
 
             if rule_format == 'srs':
-                tmp_path = self._make_temp_path('.srs')
-                with open(tmp_path, 'wb') as tmp_in:
-                    tmp_in.write(response.content)
-
-                try:
-                    return self._read_srs_file(tmp_path)
-                finally:
-                    if os.path.exists(tmp_path):
-                        os.unlink(tmp_path)
+                return self._read_srs_content(content, url)
             
-            content_type = response.headers.get('content-type', '')
             # rule_format 优先；仅当格式未明确指定时依赖 Content-Type / URL 后缀推断
             is_yaml = (rule_format == 'yaml') or (
-                rule_format not in ('mrs', 'text', 'json', 'srs') and
+                rule_format not in ('mrs', 'text', 'json', 'srs', *DOMAIN_LIST_FORMATS) and
                 ('yaml' in content_type or url.endswith(('.yml', '.yaml')))
             )
             if is_yaml:
-                data = yaml.safe_load(response.text)
-                return self._extract_yaml_rules(data, url)
+                return self._load_yaml_rules(content.decode('utf-8', errors='replace'), url)
             
             if rule_format == 'mrs':
-                tmp_path = self._make_temp_path('.mrs')
-                with open(tmp_path, 'wb') as tmp_in:
-                    tmp_in.write(response.content)
-                
-                try:
-                    return self._read_mrs_file(tmp_path, behavior)
-                finally:
-                    if os.path.exists(tmp_path):
-                        os.unlink(tmp_path)
+                return self._read_mrs_content(content, behavior, url)
 
-            return response.text.splitlines()
+            return self._iter_lines(io.BytesIO(content))
         except Exception as e:
-            self.logger.error(f"获取规则失败 {url}: {str(e)}", exc_info=True)
+            self.logger.error(f"解析规则失败 {url}: {str(e)}", exc_info=True)
             return []
     
-    def _transform(self, rule: str, source_behavior: str, target_behavior: str) -> List[str]:
-        """转换规则格式"""
-        if not rule:
-            return []
-            
-        if source_behavior == target_behavior:
-            validators = {
-                'classical': self._validate_classical_rule,
-                'ipcidr': self._validate_ipcidr_rule,
-                'domain': self._validate_domain_rule,
-                'sing-box': self._validate_sing_box_rule
-            }
-            validator = validators.get(source_behavior)
-            if validator:
-                validated = validator(rule)
-                return [validated] if validated else []
-            return [rule]
-            
-        transformer = self._transformers.get((source_behavior, target_behavior))
-        if not transformer:
-            return []
-            
-        transformed = transformer(rule)
-        if not transformed:
-            return []
-        if isinstance(transformed, list):
-            return transformed
-        return [transformed]
-
-    def _classical_to_ipcidr(self, rule: str) -> Optional[str]:
-        """将经典规则转换为IP-CIDR规则"""
-        parts = rule.split(',')
-        if len(parts) < 2:
-            return None
-        
-        suffix = parts[0].strip()
-        ipcidr = parts[1].strip()
-        if not (suffix == 'IP-CIDR' or suffix == 'IP-CIDR6'):
-            return None
-        return self._validate_ipcidr_rule(ipcidr)
-    
-    def _classical_to_domain(self, rule: str) -> Optional[str]:
-        """将经典规则转换为DOMAIN规则"""
-        parts = rule.split(',')
-        if len(parts) < 2:
-            return None
-        
-        suffix = parts[0].strip()
-        domain = parts[1].strip()
-        # 验证域名格式
-        if not DOMAIN_PATTERN.match(domain):
-            return None
-            
-        if suffix == 'DOMAIN':
-            return domain
-        elif suffix == 'DOMAIN-SUFFIX':
-            return '+.' + domain
-        return None
-    
-    def _ipcidr_to_classical(self, rule: str) -> Optional[str]:
-        """将IP-CIDR规则转换为经典规则"""
-        ip_version = self._get_ipcidr_version(rule)
-        if not ip_version:
-            return None
-        if ip_version == 6:
-            return "IP-CIDR6," + rule
-        return "IP-CIDR," + rule
-    
-    def _domain_to_classical(self, rule: str) -> Optional[str]:
-        """将DOMAIN规则转换为经典规则"""
-        if rule.startswith('+.'):
-            suffix = rule[2:]
-            if not DOMAIN_PATTERN.match(suffix):
-                return None
-            return f"DOMAIN-SUFFIX,{suffix}"
-        
-        if not DOMAIN_PATTERN.match(rule):
-            return None
-        return f"DOMAIN,{rule}"
-    
-    def _read_local_rules(self, path: str, rule_format: str, behavior: str = 'classical') -> List[str]:
-        """读取本地规则"""
+    def _read_local_rules(self, path: str, rule_format: str, behavior: str = 'classical') -> Iterable[str]:
+        """读取本地规则，text 格式逐行惰性返回"""
         try:
             if rule_format == 'mrs':
                 return self._read_mrs_file(path, behavior)
             if rule_format == 'srs':
                 return self._read_srs_file(path)
+            if rule_format not in ('json', 'yaml'):
+                return self._iter_lines(open(path, 'rb'))
 
             with open(path, 'r', encoding='utf-8') as f:
                 if rule_format == 'json':
                     return self._read_sing_box_source(f.read())
-                if rule_format == 'yaml':
-                    data = yaml.safe_load(f)
-                    return self._extract_yaml_rules(data, path)
-                return f.read().splitlines()
+                return self._load_yaml_rules(f.read(), path)
         except Exception as e:
             self.logger.error(f"读取本地规则失败 {path}: {str(e)}")
             return []
 
+    def _iter_lines(self, stream: io.BufferedIOBase) -> Iterator[str]:
+        """逐行解码文本内容，避免整体解码及生成完整的行列表"""
+        with stream:
+            for line in stream:
+                yield line.decode('utf-8', errors='replace').rstrip('\r\n')
+
+    def _load_yaml_rules(self, content: str, source: str) -> List[str]:
+        """读取 YAML 规则，仅含 payload 列表的常见文件走快速路径"""
+        rules = self._parse_yaml_payload(content)
+        if rules is not None:
+            return rules
+        data = yaml.load(content, Loader=YAML_LOADER)
+        return self._extract_yaml_rules(data, source)
+
+    def _parse_yaml_payload(self, content: str) -> Optional[List[str]]:
+        """逐行解析扁平的 payload 列表；遇到任何无法确定语义的写法返回 None"""
+        rules = []
+        has_payload = False
+        for line in content.lstrip('\ufeff').splitlines():
+            stripped = line.strip()
+            if not stripped or stripped.startswith('#'):
+                continue
+            if not has_payload:
+                if line.rstrip() != 'payload:':
+                    return None
+                has_payload = True
+                continue
+
+            match = YAML_PAYLOAD_ITEM_PATTERN.match(line)
+            if not match:
+                return None
+            value = self._parse_yaml_scalar(match.group(1).strip())
+            if value is None:
+                return None
+            rules.append(value)
+        return rules if has_payload else None
+
+    def _parse_yaml_scalar(self, value: str) -> Optional[str]:
+        """解析简单的单行字符串标量，存在转义、注释或隐式类型时返回 None"""
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in ('"', "'"):
+            inner = value[1:-1]
+            if value[0] in inner or '\\' in inner:
+                return None
+            return inner
+        if not YAML_PLAIN_PATTERN.match(value) or value.endswith(':'):
+            return None
+        if self._has_implicit_yaml_type(value):
+            return None
+        return value
+
+    def _has_implicit_yaml_type(self, value: str) -> bool:
+        """plain scalar 是否会被 YAML 解析为字符串以外的类型（数字、布尔、日期等）"""
+        resolvers = yaml.resolver.Resolver.yaml_implicit_resolvers.get(value[0], [])
+        return any(regexp.match(value) for _, regexp in resolvers)
+
     def _extract_yaml_rules(self, data: Any, source: str) -> List[str]:
         """从 YAML 内容中提取规则列表。"""
         if data is None:
@@ -229,6 +1155,8 @@ class RulesMerger:
     def _clean_rule(self, rule: str) -> str:
         """清理规则中的注释内容"""
         rule = rule.strip()
+        if '#' not in rule:
+            return rule
         
         if rule.startswith('#'):
             return ''
@@ -239,44 +1167,573 @@ class RulesMerger:
 
         return rule.strip()
     
-    def _process_source(self, source: Dict, target_behavior: str) -> List[str]:
-        """处理单个规则源"""
+    def _get_source_behavior(self, source: Dict) -> str:
         rule_format = source.get('format', 'yaml')
-        default_behavior = 'sing-box' if rule_format in ('json', 'srs') else 'classical'
-        source_behavior = source.get('behavior', default_behavior)
+        if rule_format in ('json', 'srs'):
+            default_behavior = 'sing-box'
+        elif rule_format in DOMAIN_LIST_FORMATS:
+            default_behavior = 'domain'
+        else:
+            default_behavior = 'classical'
+        return source.get('behavior', default_behavior)
 
+    def _source_key(self, source: Dict) -> tuple:
+        """规则源缓存键：类型、地址、格式、规则格式一致即视为同一规则源。"""
         source_type = source.get('type')
+        location = source.get('url') if source_type == 'http' else source.get('path')
+        return (
+            source_type,
+            location,
+            source.get('format', 'yaml'),
+            self._get_source_behavior(source)
+        )
+
+    def _read_source(self, source: Dict) -> Iterable[str]:
+        source_type, _, rule_format, source_behavior = self._source_key(source)
         if source_type == 'http':
             url = source.get('url')
             if not url:
                 self.logger.warning("http规则源缺少url")
                 return []
-            rules = self._fetch_http_rules(url, rule_format, source_behavior)
-        elif source_type == 'file':
+            return self._fetch_http_rules(url, rule_format, source_behavior)
+        if source_type == 'file':
             path = source.get('path')
             if not path:
                 self.logger.warning("file规则源缺少path")
                 return []
-            rules = self._read_local_rules(path, rule_format, source_behavior)
+            return self._read_local_rules(path, rule_format, source_behavior)
+        self.logger.warning(f"不支持的规则源类型: {source_type}")
+        return []
+
+    def _get_cached(
+        self,
+        cache: Dict[tuple, List[tuple]],
+        key: tuple,
+        loader: Callable[[], List[tuple]]
+    ) -> List[tuple]:
+        """读取引用计数缓存，同一键同时只由一个线程计算"""
+        with self._cache_lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            value = cache.get(key)
+            if value is None:
+                value = loader()
+                cache[key] = value
+            return value
+
+    def _release_cache(self, cache: Dict[tuple, Any], refs: Dict[tuple, int], key: tuple) -> None:
+        """减少缓存引用计数，无人使用时释放缓存"""
+        with self._cache_lock:
+            refs[key] = refs.get(key, 0) - 1
+            if refs[key] <= 0:
+                cache.pop(key, None)
+
+    def _process_source(self, source: Dict, target_behavior: str) -> Iterable[str]:
+        """处理单个规则源，输出目标格式的规则"""
+        entries = self._source_entries(source)
+        return self._emit_rules(entries, target_behavior, self._get_source_behavior(source) == 'sing-box')
+
+    def _source_entries(self, source: Dict) -> Iterable[tuple]:
+        """规则源的规范规则条目，同一规则源被多处引用时只解析一次"""
+        key = self._source_key(source)
+        if self.resident:
+            return self._get_resident_entries(source, key)
+
+        with self._cache_lock:
+            shared = self._entries_refs.get(key, 0) > 1 or key in self._entries_cache
+        if shared:
+            entries = self._get_cached(self._entries_cache, key, lambda: self._load_entries(source))
+        elif self.report is not None:
+            entries = self._load_entries(source)
         else:
-            self.logger.warning(f"不支持的规则源类型: {source_type}")
+            entries = self._iter_entries(source)
+
+        self._release_cache(self._entries_cache, self._entries_refs, key)
+        return entries
+
+    def _get_resident_entries(self, source: Dict, key: tuple) -> List[tuple]:
+        """常驻模式下复用上一轮的解析结果，规则源内容变更后才重新解析"""
+        digest = self._source_digest(source)
+        with self._cache_lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            cached = self._resident_entries.get(key)
+            if cached is None or digest is None or cached[0] != digest:
+                cached = (digest, self._load_entries(source))
+                self._resident_entries[key] = cached
+            return cached[1]
+
+    def _load_entries(self, source: Dict) -> List[tuple]:
+        """读取并验证整个规则源，开启运行报告时记录规则数"""
+        name = source.get('url') or source.get('path') or ''
+        with self._stage('source', name, 'parse') as record:
+            entries = list(self._iter_entries(source, record))
+            record['rules_kept'] = len(entries)
+        return entries
+
+    def _iter_entries(self, source: Dict, record: Optional[Dict[str, Any]] = None) -> Iterator[tuple]:
+        """将规则源逐条清理、验证为规范规则条目 (类型, 值, 附加参数)"""
+        rule_format = source.get('format', 'yaml')
+        source_behavior = self._get_source_behavior(source)
+        if source_behavior not in ('classical', 'domain', 'ipcidr', 'sing-box'):
+            self.logger.warning(f"不支持的规则格式: {source_behavior}")
+            return
+        if rule_format in DOMAIN_LIST_FORMATS and source_behavior not in ('classical', 'domain'):
+            self.logger.warning(f"{rule_format} 规则源仅支持 domain / classical 规则格式: {source_behavior}")
+            return
+
+        counts = [0, 0]
+        try:
+            if source_behavior != 'sing-box' and self._is_large_source(source):
+                yield from self._parse_entries_parallel(source, source_behavior, counts)
+            else:
+                yield from self._parse_rules(self._read_source(source), rule_format, source_behavior, counts)
+        finally:
+            if record is not None:
+                record['rules_in'] = counts[0]
+                record['rules_rejected'] = counts[1]
+
+    def _is_large_source(self, source: Dict) -> bool:
+        """规则源内容是否超过分块并行解析的阈值"""
+        if self.parse_processes <= 1 or self.large_source_size <= 0:
+            return False
+        if source.get('type') == 'http':
+            fetched = self._get_http_content(source['url']) if source.get('url') else None
+            size = len(fetched[0]) if fetched else 0
+        else:
+            try:
+                size = os.path.getsize(source.get('path') or '')
+            except OSError:
+                size = 0
+        return size >= self.large_source_size
+
+    def _parse_entries_parallel(self, source: Dict, behavior: str, counts: List[int]) -> Iterator[tuple]:
+        """将规则源按行切块，在进程池中清理、验证并在块内去重，按块顺序合并结果"""
+        chunk_count = self.parse_processes * PARSE_CHUNKS_PER_PROCESS
+        rule_format = source.get('format', 'yaml')
+        if rule_format in ('text', *DOMAIN_LIST_FORMATS):
+            # 按行读取的规则源直接按字节切分，解码交由工作进程完成
+            chunks = self._split_lines(self._read_source_bytes(source), chunk_count)
+        else:
+            rules = list(self._read_source(source))
+            chunk_size = max(1, -(-len(rules) // chunk_count))
+            chunks = [rules[start:start + chunk_size] for start in range(0, len(rules), chunk_size)]
+            del rules
+        if not chunks:
+            return
+        self.logger.info(f"大规则源分 {len(chunks)} 块并行解析, 进程数 {self.parse_processes}")
+
+        for entries, rules_in, rules_rejected in self._get_process_pool().map(
+            parse_entries_chunk, chunks, repeat(rule_format), repeat(behavior)
+        ):
+            counts[0] += rules_in
+            counts[1] += rules_rejected
+            yield from entries
+
+    def _read_source_bytes(self, source: Dict) -> bytes:
+        if source.get('type') == 'http':
+            fetched = self._take_http_content(source['url'])
+            return fetched[0] if fetched else b''
+        try:
+            with open(source['path'], 'rb') as f:
+                return f.read()
+        except OSError as e:
+            self.logger.error(f"读取本地规则失败 {source['path']}: {str(e)}")
+            return b''
+
+    def _split_lines(self, data: bytes, count: int) -> List[bytes]:
+        """按行边界将内容切分为大致等长的若干块"""
+        size = max(1, -(-len(data) // count))
+        chunks = []
+        start = 0
+        while start < len(data):
+            end = data.find(b'\n', start + size)
+            end = len(data) if end == -1 else end + 1
+            chunks.append(data[start:end])
+            start = end
+        return chunks
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        with self._cache_lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.parse_processes,
+                    mp_context=multiprocessing.get_context(PARSE_START_METHOD)
+                )
+            return self._process_pool
+
+    def _shutdown_process_pool(self) -> None:
+        with self._cache_lock:
+            pool, self._process_pool = self._process_pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def _parse_rules(self, rules: Iterable[Any], rule_format: str, behavior: str, counts: List[int]) -> Iterator[tuple]:
+        if rule_format in DOMAIN_LIST_FORMATS:
+            return self._parse_domain_list(rules, rule_format, counts)
+        return self._parse_entries(rules, behavior, counts)
+
+    def _parse_entries(self, rules: Iterable[Any], behavior: str, counts: List[int]) -> Iterator[tuple]:
+        """逐条清理、验证规则，counts 累计读取的规则数与验证失败的规则数"""
+        parser = {
+            'classical': self._parse_classical_entry,
+            'domain': self._parse_domain_entry,
+            'ipcidr': self._parse_ipcidr_entry,
+            'sing-box': self._parse_sing_box_entries
+        }[behavior]
+        rules_in = rules_rejected = 0
+        # 逐条格式化调试日志的开销与验证本身相当，仅在开启调试时生成
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        try:
+            for rule in rules:
+                rules_in += 1
+                if rule is None:
+                    continue
+                cleaned_rule = rule if behavior == 'sing-box' else self._clean_rule(str(rule))
+                if not cleaned_rule:
+                    continue
+                entries = parser(cleaned_rule)
+                if not entries:
+                    rules_rejected += 1
+                if debug:
+                    self.logger.debug(f"处理规则: {rule} -> {cleaned_rule} -> {entries}")
+                yield from entries
+        finally:
+            counts[0] += rules_in
+            counts[1] += rules_rejected
+
+    def _parse_domain_list(self, lines: Iterable[str], rule_format: str, counts: List[int]) -> Iterator[tuple]:
+        """逐行扫描 hosts / AdBlock / dnsmasq 列表，空行、注释不计为验证失败"""
+        scan = {
+            'hosts': self._scan_hosts,
+            'adblock': self._scan_adblock,
+            'dnsmasq': self._scan_dnsmasq
+        }[rule_format]
+        # 列表中的域名几乎不重复，绕过验证缓存以免每行都发生淘汰
+        return scan(lines, is_valid_domain.__wrapped__, counts)
+
+    def _scan_hosts(self, lines: Iterable[str], is_valid: Callable[[str], bool], counts: List[int]) -> Iterator[tuple]:
+        """hosts 行：首列为屏蔽地址，其后每列为一个域名；仅含本机条目的行与注释同样跳过，其他地址的映射不是拦截规则，计为验证失败"""
+        rules_in = rules_rejected = 0
+        # hosts 列表的地址列几乎只有少数几种取值，已验证的地址不再重复解析
+        sinkholes = set()
+        try:
+            for line in lines:
+                rules_in += 1
+                comment = line.find('#')
+                if comment != -1:
+                    line = line[:comment]
+                names = line.split()
+                domains = [name for name in map(str.lower, islice(names, 1, None)) if name not in HOSTS_IGNORED_NAMES]
+                if not domains:
+                    continue
+                if names[0] not in sinkholes:
+                    if not is_sinkhole_address(names[0]):
+                        rules_rejected += 1
+                        continue
+                    sinkholes.add(names[0])
+                kept = 0
+                for name in domains:
+                    if is_valid(name):
+                        kept += 1
+                        yield ('domain', name, ())
+                if not kept:
+                    rules_rejected += 1
+        finally:
+            counts[0] += rules_in
+            counts[1] += rules_rejected
+
+    def _scan_adblock(self, lines: Iterable[str], is_valid: Callable[[str], bool], counts: List[int]) -> Iterator[tuple]:
+        """AdBlock 行：仅接受 ||domain^ 形式的域名规则，例外 (@@)、元素隐藏及路径、通配规则均丢弃"""
+        rules_in = rules_rejected = 0
+        try:
+            for line in lines:
+                rules_in += 1
+                line = line.strip()
+                if not line or line[0] in '![':
+                    continue
+                if not line.startswith('||'):
+                    rules_rejected += 1
+                    continue
+
+                end = line.find('^', 2)
+                if end == -1:
+                    end = line.find('$', 2)
+                    if end == -1:
+                        end = len(line)
+                    options = line[end:]
+                else:
+                    options = line[end + 1:]
+                    if options[:1] == '|':
+                        options = options[1:]
+                domain = line[2:end].lower()
+                if options and (options[0] != '$' or not ADBLOCK_MODIFIERS.issuperset(options[1:].lower().split(','))):
+                    rules_rejected += 1
+                elif is_valid(domain):
+                    yield ('domain_suffix', domain, ())
+                else:
+                    rules_rejected += 1
+        finally:
+            counts[0] += rules_in
+            counts[1] += rules_rejected
+
+    def _scan_dnsmasq(self, lines: Iterable[str], is_valid: Callable[[str], bool], counts: List[int]) -> Iterator[tuple]:
+        """dnsmasq 行：address=/a.com/b.com/0.0.0.0 中两个斜杠之间的每一段为一个域名 (含子域名)，目标须为屏蔽地址"""
+        rules_in = rules_rejected = 0
+        try:
+            for line in lines:
+                rules_in += 1
+                line = line.strip()
+                if not line or line[0] == '#':
+                    continue
+                end = line.rfind('/')
+                target = line[end + 1:].strip()
+                if not line.startswith(DNSMASQ_BLOCK_DIRECTIVE) or not (
+                    target in DNSMASQ_BLOCK_TARGETS or is_sinkhole_address(target)
+                ):
+                    rules_rejected += 1
+                    continue
+
+                kept = 0
+                for domain in line[len(DNSMASQ_BLOCK_DIRECTIVE):end].split('/'):
+                    domain = domain.lower()
+                    if is_valid(domain):
+                        kept += 1
+                        yield ('domain_suffix', domain, ())
+                if not kept:
+                    rules_rejected += 1
+        finally:
+            counts[0] += rules_in
+            counts[1] += rules_rejected
+
+    def _parse_classical_entry(self, rule: str) -> List[tuple]:
+        # 规则按行存储与输出，含换行的规则 (如 YAML 多行字符串) 会被拆成多条
+        if '\n' in rule or '\r' in rule:
+            self.logger.debug(f"规则含换行符: {rule!r}")
+            return []
+        parts = rule.split(',')
+        if ' ' in rule or '\t' in rule:
+            parts = [part.strip() for part in parts]
+        if len(parts) < 2:
             return []
 
-        converted_rules = []
-        for rule in rules:
-            if rule is None:
-                continue
-            cleaned_rule = rule if source_behavior == 'sing-box' else self._clean_rule(str(rule))
-            transformed_rules = self._transform(cleaned_rule, source_behavior, target_behavior)
-            self.logger.debug(f"处理规则: {rule} -> {cleaned_rule} -> {transformed_rules}")
-            if not transformed_rules:
+        rule_type, value = parts[0], parts[1]
+        kind = CLASSICAL_TO_SING_BOX.get(rule_type)
+        if kind is None:
+            # 其他类型的规则只能原样输出为 classical
+            return [('classical', ','.join(parts), ())]
+
+        if kind in ('domain', 'domain_suffix'):
+            valid = is_valid_domain(value)
+        elif kind == 'ip_cidr':
+            valid = self._get_ipcidr_version(value) == (6 if rule_type == 'IP-CIDR6' else 4)
+        else:
+            valid = True
+
+        if not valid:
+            self.logger.debug(f"规则验证失败: {rule}")
+            return []
+        return [(kind, value, tuple(parts[2:]))]
+
+    def _parse_domain_entry(self, rule: str) -> List[tuple]:
+        # +.example.com 形式的 suffix 规则需要去掉前缀再验证
+        if rule.startswith('+.'):
+            kind, domain = 'domain_suffix', rule[2:]
+        else:
+            kind, domain = 'domain', rule
+        if not is_valid_domain(domain):
+            self.logger.debug(f"域名规则验证失败: {rule}")
+            return []
+        return [(kind, domain, ())]
+
+    def _parse_ipcidr_entry(self, rule: str) -> List[tuple]:
+        if not self._get_ipcidr_version(rule):
+            self.logger.debug(f"IP-CIDR 规则验证失败: {rule}")
+            return []
+        return [('ip_cidr', rule, ())]
+
+    def _parse_sing_box_entries(self, rule: Any) -> List[tuple]:
+        """sing-box 规则整条保留用于 sing-box 输出，同时拆出可用于其他格式的条目"""
+        parsed = self._parse_sing_box_rule(rule)
+        if parsed is None:
+            self.logger.debug(f"sing-box 规则验证失败: {rule}")
+            return []
+
+        entries = [('sing-box', parsed, ())]
+        for rule_item in self._iter_sing_box_rules(parsed):
+            item = dict(rule_item)
+            for domain in self._as_list(item.get('domain')):
+                if isinstance(domain, str) and is_valid_domain(domain):
+                    entries.append(('domain', domain, ()))
+            for suffix in self._as_list(item.get('domain_suffix')):
+                if isinstance(suffix, str):
+                    suffix = suffix[1:] if suffix.startswith('.') else suffix
+                    if is_valid_domain(suffix):
+                        entries.append(('domain_suffix', suffix, ()))
+            for key in ('domain_keyword', 'domain_regex'):
+                for value in self._as_list(item.get(key)):
+                    # sing-box 规则以 JSON 保存不受影响，拆出的条目按行输出，含换行时不拆出
+                    if isinstance(value, str) and '\n' not in value and '\r' not in value:
+                        entries.append((key, value, ()))
+            for ipcidr in self._as_list(item.get('ip_cidr')):
+                if isinstance(ipcidr, str) and self._get_ipcidr_version(ipcidr):
+                    entries.append(('ip_cidr', ipcidr, ()))
+        return entries
+
+    def _emit_rules(self, entries: Iterable[tuple], target_behavior: str, from_sing_box: bool) -> Iterator[Any]:
+        for entry in entries:
+            rule = self._emit_entry(entry, target_behavior, from_sing_box)
+            if rule:
+                yield rule
+
+    def _emit_entry(self, entry: tuple, target_behavior: str, from_sing_box: bool) -> Any:
+        """将规范规则条目输出为目标格式的规则，不适用时返回 None"""
+        kind, value, options = entry
+        if kind == 'classical':
+            return value if target_behavior == 'classical' else None
+        if kind == 'sing-box':
+            return value if target_behavior == 'sing-box' else None
+
+        if target_behavior == 'classical':
+            rule_type = SING_BOX_TO_CLASSICAL[kind]
+            if kind == 'ip_cidr' and ':' in value:
+                rule_type = 'IP-CIDR6'
+            return ','.join((rule_type, value) + options)
+        if target_behavior == 'domain':
+            if kind == 'domain':
+                return value
+            if kind == 'domain_suffix':
+                return '+.' + value
+            return None
+        if target_behavior == 'ipcidr':
+            return value if kind == 'ip_cidr' else None
+        if target_behavior == 'sing-box' and not from_sing_box:
+            # sing-box 规则源已整条保留，拆出的条目不再重复输出
+            return SingBoxRule(((kind, (value,)),))
+        return None
+
+    def _config_sources(self, config: Dict) -> List[Dict]:
+        """输出配置引用的所有规则源，包括 upstream 与 exclude"""
+        return list(config['upstream'].values()) + list((config.get('exclude') or {}).values())
+
+    def _count_source_usage(self, plans: List[Dict]) -> None:
+        """统计本次需要生成的输出对各规则源的引用次数，并释放不再需要的上游内容"""
+        self._entries_refs.clear()
+        for plan in plans:
+            for source_config in self._config_sources(plan['config']):
+                key = self._source_key(source_config)
+                self._entries_refs[key] = self._entries_refs.get(key, 0) + 1
+        if self.resident:
+            return
+
+        # 同一规则源只解析一次，按不重复的规则源统计各 url 内容的使用次数
+        self._http_content_refs.clear()
+        for source_type, location, _, _ in self._entries_refs:
+            if source_type == 'http':
+                self._http_content_refs[location] = self._http_content_refs.get(location, 0) + 1
+        for url in list(self._http_content_cache):
+            if url not in self._http_content_refs:
+                self._http_content_cache.pop(url)
+
+    def _prefetch_sources(self) -> None:
+        """并发获取配置中所有不重复的 http 规则源"""
+        urls = []
+        for config in self.config:
+            if 'upstream' not in config or not config.get('path'):
                 continue
-            converted_rules.extend(transformed_rules)
-        
-        return converted_rules
-    
-    def merge_rules(self) -> None:
-        """合并所有规则并生成文件"""
+            for source_config in self._config_sources(config):
+                url = source_config.get('url')
+                if source_config.get('type') == 'http' and url and url not in urls:
+                    urls.append(url)
+
+        if not urls:
+            return
+
+        workers = max(1, min(self.fetch_workers, len(urls)))
+        self.logger.info(f"并发获取 {len(urls)} 个上游规则源, 线程数 {workers}")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # _fetch_http_content 内部已处理异常，单个上游失败或超时不影响其他上游
+            list(executor.map(self._profiled(self._get_http_content), urls))
+
+    def _source_digest(self, source: Dict) -> Optional[str]:
+        """规则源内容的 SHA-256，获取失败时返回 None"""
+        source_type = source.get('type')
+        if source_type == 'http' and source.get('url'):
+            fetched = self._get_http_content(source['url'])
+            if fetched is None:
+                return None
+            return hashlib.sha256(fetched[0]).hexdigest()
+        if source_type == 'file' and source.get('path'):
+            try:
+                with open(source['path'], 'rb') as f:
+                    return hashlib.sha256(f.read()).hexdigest()
+            except OSError:
+                return None
+        return None
+
+    def _get_tool_version(self, tool: str) -> Optional[str]:
+        """获取外部工具版本，用于判断输出是否需要重新生成"""
+        if tool not in self._tool_versions:
+            commands = {
+                'mihomo': [self.mihomo_path, '-v'],
+                'sing-box': [self.sing_box_path, 'version']
+            }
+            version = None
+            try:
+                result = subprocess.run(commands[tool], capture_output=True, text=True)
+                if result.returncode == 0 and result.stdout:
+                    version = result.stdout.splitlines()[0].strip()
+            except Exception as e:
+                self.logger.debug(f"获取 {tool} 版本失败: {e}")
+            self._tool_versions[tool] = version
+        return self._tool_versions[tool]
+
+    def _output_fingerprint(self, config: Dict) -> str:
+        """计算输出文件的输入指纹：配置项、上游内容、工具版本及脚本本身"""
+        formats = {config.get('format', 'yaml')}
+        formats.update(source.get('format', 'yaml') for source in self._config_sources(config))
+        tools = {}
+        if 'mrs' in formats and zstandard is None:
+            tools['mihomo'] = self._get_tool_version('mihomo')
+        if 'srs' in formats:
+            tools['sing-box'] = self._get_tool_version('sing-box')
+
+        fingerprint = {
+            'config': config,
+            'upstream': {
+                name: self._source_digest(source)
+                for name, source in config['upstream'].items()
+            },
+            'exclude': {
+                name: self._source_digest(source)
+                for name, source in (config.get('exclude') or {}).items()
+            },
+            'tools': tools,
+            'sing_box_ruleset_version': SING_BOX_RULESET_VERSION,
+            'script': script_digest()
+        }
+        data = json.dumps(fingerprint, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _load_manifest(self) -> Dict[str, str]:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def _save_manifest(self, manifest: Dict[str, str]) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+            data = json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True)
+            self._atomic_write(self.manifest_path, data.encode('utf-8'))
+        except OSError as e:
+            self.logger.warning(f"写入构建清单失败: {e}")
+
+    def _plan_outputs(self, manifest: Dict[str, str], force: bool) -> List[Dict]:
+        """确定本次需要生成的输出文件，输入未变更的输出将被跳过"""
+        plans = []
         for config in self.config:
             if 'upstream' not in config or not config.get('path'):
                 continue
@@ -285,30 +1742,745 @@ class RulesMerger:
             target_format = config.get('format', 'yaml')
             default_behavior = 'sing-box' if target_format in ('json', 'srs') else 'classical'
             target_behavior = config.get('behavior', default_behavior)
-            merged_rules = []
 
             if target_format == 'mrs' and target_behavior not in ('domain', 'ipcidr'):
                 self.logger.info(f"{config.get('path')}: mrs格式仅支持domain/ipcidr")
                 continue
             
-            # 处理每个上游源
-            for source_config in config['upstream'].values():
-                rules = self._process_source(source_config, target_behavior)
-                merged_rules.extend(rules)
-            
-            # 去重和排序
-            merged_rules = sorted(set(merged_rules))
-            
-            # 获取输出格式
             output_file = config['path']
-            self._write_rules(
-                output_file,
-                merged_rules,
-                target_format,
-                target_behavior,
-                config.get('version', SING_BOX_RULESET_VERSION)
+            fingerprint = self._output_fingerprint(config)
+            if not force and manifest.get(output_file) == fingerprint and os.path.exists(output_file):
+                self.logger.info(f"输入未变更, 跳过: {output_file}")
+                continue
+
+            plans.append({
+                'config': config,
+                'path': output_file,
+                'format': target_format,
+                'behavior': target_behavior,
+                'fingerprint': fingerprint,
+                'force': force
+            })
+        return plans
+
+    def _build_output(self, plan: Dict) -> bool:
+        """合并单个输出文件的所有上游并写入文件"""
+        config = plan['config']
+        target_behavior = plan['behavior']
+        path = plan['path']
+
+        # 处理每个上游源，直接流入去重集合
+        with self._stage('output', path, 'merge') as record:
+            merged_rules = self._collect_rules(chain.from_iterable(
+                self._process_source(source_config, target_behavior)
+                for source_config in config['upstream'].values()
+            ), target_behavior)
+            record['rules_kept'] = len(merged_rules)
+
+        if config.get('exclude'):
+            with self._stage('output', path, 'exclude') as record:
+                record['rules_in'] = len(merged_rules)
+                merged_rules = self._collect_rules(self._exclude_rules(
+                    path, merged_rules, target_behavior, self._build_exclude_index(config['exclude'])
+                ), target_behavior)
+                record['rules_kept'] = len(merged_rules)
+        
+        # 排序
+        with self._stage('output', path, 'dedup') as record:
+            # sing-box 规则在输出时排序，其余规则已在紧凑集合中有序存放
+            sorted_rules = list(merged_rules) if target_behavior == 'sing-box' else merged_rules
+            del merged_rules
+            record['rules_kept'] = len(sorted_rules)
+        with self._stage('output', path, 'optimize') as record:
+            record['rules_in'] = len(sorted_rules)
+            sorted_rules = self._optimize_rules(
+                path, sorted_rules, target_behavior, self._as_list(config.get('optimize'))
             )
+            if isinstance(sorted_rules, list) and target_behavior != 'sing-box':
+                sorted_rules = PackedRuleSet.from_sorted(sorted_rules)
+            record['rules_kept'] = len(sorted_rules)
+        
+        encodings = self._precompress_encodings(config, plan['format'])
+        with self._stage('output', path, 'write') as record:
+            record['rules_in'] = len(sorted_rules)
+            version = config.get('version', SING_BOX_RULESET_VERSION)
+            state = self._load_output_state(path)
+            rule_lines = self._canonical_rules(sorted_rules, target_behavior)
+            content_hash = hashlib.sha256(rule_lines.joined()).hexdigest()
+            # 规则与写出方式均未变更时保留原文件，避免仅更新时间不同导致下游重新下载
+            writer = hashlib.sha256(json.dumps(
+                [plan['format'], target_behavior, version, script_digest()], default=str
+            ).encode('utf-8')).hexdigest()
+            unchanged = state and state.get('hash') == content_hash and state.get('writer') == writer
+            if unchanged and not plan.get('force') and os.path.exists(path):
+                self.logger.info(f"规则未变更, 保留文件: {path}")
+                # 原文件未变更时已有的预压缩文件仍然有效，只补齐新启用的编码
+                self._write_precompressed(path, encodings, refresh=False)
+                return True
+
+            written = self._write_rules(path, sorted_rules, plan['format'], target_behavior, version)
+            if written and os.path.exists(path):
+                record['bytes'] = os.path.getsize(path)
+        if written:
+            with self._stage('output', path, 'compress') as record:
+                record['bytes'] = self._write_precompressed(path, encodings, refresh=True)
+            keep_rules = bool(config.get('delta'))
+            # 规则未变更 (如 --force 重写) 时保留上一份增量，避免 from == to 的空增量覆盖客户端所需的版本
+            if keep_rules and state and state.get('rules') is not None and state.get('hash') != content_hash:
+                self._write_delta(path, state, rule_lines, content_hash)
+            self._save_output_state(path, {
+                'path': path,
+                'hash': content_hash,
+                'writer': writer,
+                'rules': list(rule_lines) if keep_rules else None
+            })
+        return written
+
+    def _precompress_encodings(self, config: Dict, rule_format: str) -> List[str]:
+        """输出配置中启用的预压缩编码，compress: true 表示全部启用"""
+        compress = config.get('compress')
+        if not compress:
+            return []
+        if rule_format not in PRECOMPRESS_FORMATS:
+            self.logger.warning(f"{rule_format} 格式本身已压缩, 不生成预压缩文件: {config['path']}")
+            return []
+        encodings = list(PRECOMPRESS_SUFFIXES) if compress is True else self._as_list(compress)
+        for encoding in encodings:
+            if encoding not in PRECOMPRESS_SUFFIXES:
+                self.logger.warning(f"不支持的压缩格式: {encoding}")
+        return [encoding for encoding in PRECOMPRESS_SUFFIXES if encoding in encodings]
+
+    def _write_precompressed(self, path: str, encodings: List[str], refresh: bool) -> int:
+        """在输出文件旁以最高压缩级别写入预压缩文件，返回写入的字节数
+
+        refresh 为 False 时只补齐缺失的文件；原文件重新写出时删除未启用编码的旧文件，以免提供过期内容
+        """
+        data = None
+        total = 0
+        for encoding, suffix in PRECOMPRESS_SUFFIXES.items():
+            compressed_path = path + suffix
+            exists = os.path.exists(compressed_path)
+            if encoding in encodings and not (exists and not refresh):
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                compressed = self._compress(data, encoding)
+                if compressed is not None:
+                    self._atomic_write(compressed_path, compressed)
+                    total += len(compressed)
+                    self.logger.info(
+                        f"已生成预压缩文件: {compressed_path}, {len(data)} -> {len(compressed)} 字节"
+                    )
+                    continue
+                self.logger.warning(f"未安装 {encoding} 压缩库, 跳过: {compressed_path}")
+            if refresh and exists:
+                os.remove(compressed_path)
+                self.logger.info(f"已删除过期的预压缩文件: {compressed_path}")
+        return total
+
+    def _compress(self, data: bytes, encoding: str) -> Optional[bytes]:
+        """按 Content-Encoding 压缩内容，缺少对应压缩库时返回 None"""
+        if encoding == 'gzip':
+            # 固定 mtime，内容不变时压缩结果逐字节一致
+            return gzip.compress(data, compresslevel=GZIP_COMPRESSION_LEVEL, mtime=0)
+        if encoding == 'br':
+            return brotli.compress(data, quality=BROTLI_QUALITY) if brotli is not None else None
+        if zstandard is None:
+            return None
+        params = zstandard.ZstdCompressionParameters.from_level(
+            ZSTD_COMPRESSION_LEVEL, source_size=len(data), window_log=ZSTD_WINDOW_LOG
+        )
+        return zstandard.ZstdCompressor(compression_params=params).compress(data)
+
+    def _canonical_rules(self, rules: Iterable[Any], behavior: str) -> PackedRuleSet:
+        """规则的规范文本，按序排列，用于计算内容哈希与增量"""
+        if behavior == 'sing-box':
+            return PackedRuleSet.from_sorted(sorted(rule.to_json() for rule in rules))
+        return rules
+
+    def _collect_rules(self, rules: Iterable[Any], behavior: str) -> Any:
+        """合并去重：sing-box 规则存入集合，其余规则存入排序后的紧凑集合"""
+        if behavior == 'sing-box':
+            return set(rules)
+        return PackedRuleSet.build(rules)
+
+    def _output_state_path(self, path: str) -> str:
+        name = hashlib.sha256(path.encode('utf-8')).hexdigest()
+        return os.path.join(self.output_state_dir, name + '.json')
+
+    def _load_output_state(self, path: str) -> Optional[Dict[str, Any]]:
+        """读取输出文件上次写出时的内容哈希及规则，缺失或损坏时返回 None"""
+        try:
+            with open(self._output_state_path(path), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return state if isinstance(state, dict) and state.get('path') == path else None
+
+    def _save_output_state(self, path: str, state: Dict[str, Any]) -> None:
+        try:
+            os.makedirs(self.output_state_dir, exist_ok=True)
+            data = json.dumps(state, ensure_ascii=False, separators=(',', ':'))
+            self._atomic_write(self._output_state_path(path), data.encode('utf-8'))
+        except OSError as e:
+            self.logger.warning(f"写入输出状态失败 {path}: {e}")
+
+    def _write_delta(self, path: str, state: Dict[str, Any], rules: List[str], content_hash: str) -> None:
+        """在输出文件旁写入相对上一版本的增量，客户端持有 from 版本时可只下载增量"""
+        previous = set(state['rules'])
+        current = set(rules)
+        delta = {
+            'from': state.get('hash'),
+            'to': content_hash,
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'added': sorted(current - previous),
+            'removed': sorted(previous - current)
+        }
+        delta_path = path + DELTA_SUFFIX
+        data = json.dumps(delta, ensure_ascii=False, indent=2) + '\n'
+        self._atomic_write(delta_path, data.encode('utf-8'))
+        self.logger.info(
+            f"已生成增量文件: {delta_path}, 新增 {len(delta['added'])} 条, 删除 {len(delta['removed'])} 条"
+        )
 
+    def merge_rules(self, force: bool = False) -> None:
+        """合并所有规则并生成文件，输入未变更的输出文件将被跳过"""
+        with self._stage('run', 'merge_rules', 'total'):
+            try:
+                self._profiled(self._merge_rules, worker=False)(force)
+            finally:
+                self._shutdown_process_pool()
+        if self._profiles:
+            self._save_profile()
+
+    def _merge_rules(self, force: bool) -> None:
+        if self.parse_processes > 1 and self.large_source_size > 0:
+            # 在主线程中预先创建进程池；工作进程在首次提交任务时才由 forkserver (或 spawn) 启动，
+            # 不会复制主进程及其中运行的输出线程，因此无需在输出线程之前启动
+            self._get_process_pool()
+        self._prefetch_sources()
+        manifest = self._load_manifest()
+        plans = self._plan_outputs(manifest, force)
+        self._count_source_usage(plans)
+
+        workers = max(1, min(self.output_workers, len(plans)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            build = self._profiled(self._build_output_buffered)
+            futures = [executor.submit(build, plan) for plan in plans]
+            # 按配置顺序收集结果并输出日志，保证日志顺序与并发度无关
+            for plan, future in zip(plans, futures):
+                written, records = future.result()
+                for record in records:
+                    self.logger.handle(record)
+                if written:
+                    manifest[plan['path']] = plan['fingerprint']
+                else:
+                    manifest.pop(plan['path'], None)
+
+        self._save_manifest(manifest)
+
+    def _build_output_buffered(self, plan: Dict) -> tuple[bool, List[logging.LogRecord]]:
+        """在工作线程中生成输出文件，并返回期间暂存的日志"""
+        _log_buffer.records = []
+        try:
+            try:
+                written = self._build_output(plan)
+            except Exception as e:
+                self.logger.error(f"生成输出文件失败 {plan['path']}: {str(e)}", exc_info=True)
+                written = False
+            return written, _log_buffer.records
+        finally:
+            _log_buffer.records = None
+
+    def run_daemon(self, host: str = DAEMON_HOST, port: int = DAEMON_PORT, force: bool = False) -> None:
+        """常驻运行：按规则源各自的间隔刷新上游，仅重建受影响的输出，并通过 HTTP 提供输出文件"""
+        self.resident = True
+        server = OutputServer((host, port))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.logger.info(f"常驻模式已启动, 输出文件服务地址: http://{host}:{server.server_port}/")
+
+        sources = self._daemon_sources()
+        next_refresh: Dict[tuple, float] = {}
+        published: Dict[str, tuple] = {}
+        try:
+            while True:
+                now = time.monotonic()
+                due = [key for key in sources if next_refresh.get(key, 0) <= now]
+                for key in due:
+                    self._expire_source(sources[key])
+                    next_refresh[key] = now + self._refresh_interval(sources[key])
+                if due:
+                    self.logger.info(f"刷新 {len(due)} 个规则源")
+                    self.merge_rules(force=force)
+                    force = False
+                    self._publish_outputs(server, published)
+                if not next_refresh:
+                    self.logger.warning("配置中没有可刷新的规则源")
+                    next_refresh[()] = now + self.refresh_interval
+                time.sleep(max(1.0, min(next_refresh.values()) - time.monotonic()))
+        except KeyboardInterrupt:
+            self.logger.info("常驻模式已退出")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def _daemon_sources(self) -> Dict[tuple, Dict]:
+        """配置中所有不重复的规则源"""
+        sources = {}
+        for config in self.config:
+            if 'upstream' not in config or not config.get('path'):
+                continue
+            for source_config in self._config_sources(config):
+                sources.setdefault(self._source_key(source_config), source_config)
+        return sources
+
+    def _refresh_interval(self, source: Dict) -> float:
+        try:
+            return max(1.0, float(source.get('interval', self.refresh_interval)))
+        except (TypeError, ValueError):
+            self.logger.warning(f"无效的刷新间隔: {source.get('interval')}")
+            return self.refresh_interval
+
+    def _expire_source(self, source: Dict) -> None:
+        """丢弃规则源在内存中的内容，下一轮重新获取；本地文件每轮都会重新读取"""
+        if source.get('type') == 'http' and source.get('url'):
+            self._http_content_cache.pop(source['url'], None)
+
+    def _publish_outputs(self, server: OutputServer, published: Dict[str, tuple]) -> None:
+        """将变更过的输出文件载入 HTTP 服务，按文件名提供访问"""
+        for config in self.config:
+            path = config.get('path')
+            if 'upstream' not in config or not path:
+                continue
+            content_type = OUTPUT_CONTENT_TYPES.get(config.get('format', 'yaml'), 'application/octet-stream')
+            self._publish_file(server, published, path, content_type)
+            self._publish_file(server, published, path + DELTA_SUFFIX, OUTPUT_CONTENT_TYPES['json'])
+            for suffix in PRECOMPRESS_SUFFIXES.values():
+                self._publish_file(server, published, path + suffix, 'application/octet-stream')
+
+    def _publish_file(self, server: OutputServer, published: Dict[str, tuple], path: str, content_type: str) -> None:
+        url_path = '/' + os.path.basename(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # 文件已被删除 (如停用的预压缩文件) 时停止提供旧内容
+            if url_path in published and published[url_path][0] == path:
+                server.unpublish(url_path)
+                del published[url_path]
+            return
+        signature = (path, stat.st_mtime_ns, stat.st_size)
+        if url_path in published and published[url_path][0] != path:
+            self.logger.warning(f"输出文件名重复, 忽略: {path}")
+            return
+        if published.get(url_path) == signature:
+            return
+        with open(path, 'rb') as f:
+            content = f.read()
+        server.publish(url_path, content, stat.st_mtime, content_type)
+        published[url_path] = signature
+
+    def load_rule_index(self, rebuild: bool = False, cached: bool = False, refresh: bool = False) -> RuleIndex:
+        """读取持久化的查询索引，输出文件、规则源或配置变更后重新建立；默认使用本地缓存的上游内容，refresh 时重新获取"""
+        self.prefer_http_cache = not refresh
+        data = None
+        if not rebuild:
+            try:
+                with open(self.lookup_index_path, 'rb') as f:
+                    data = pickle.load(f)
+            except (OSError, pickle.PickleError, EOFError, ValueError):
+                data = None
+
+        if refresh:
+            self._prefetch_sources()
+        key = None
+        if data is not None and not cached:
+            key = self._rule_index_key()
+        if data is not None and (cached or data.get('key') == key):
+            return RuleIndex(data['index'])
+
+        if key is None:
+            key = self._rule_index_key()
+        index = self.build_rule_index()
+        try:
+            os.makedirs(os.path.dirname(self.lookup_index_path) or '.', exist_ok=True)
+            data = pickle.dumps({'key': key, 'index': index.state()}, protocol=pickle.HIGHEST_PROTOCOL)
+            self._atomic_write(self.lookup_index_path, data)
+        except OSError as e:
+            self.logger.warning(f"写入查询索引失败: {e}")
+        return index
+
+    def _rule_index_key(self) -> str:
+        """查询索引的输入指纹：配置、输出文件的修改时间、大小及构建指纹、规则源内容及脚本本身"""
+        manifest = self._load_manifest()
+        outputs = {}
+        sources = {}
+        for config in self.config:
+            if 'upstream' not in config or not config.get('path'):
+                continue
+            try:
+                stat = os.stat(config['path'])
+                outputs[config['path']] = [stat.st_mtime_ns, stat.st_size, manifest.get(config['path'])]
+            except OSError:
+                outputs[config['path']] = None
+            for source in config['upstream'].values():
+                sources[json.dumps(self._source_key(source))] = self._source_digest(source)
+        data = json.dumps(
+            [self.config, outputs, sources, script_digest()],
+            ensure_ascii=False, sort_keys=True, default=str
+        )
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def build_rule_index(self) -> RuleIndex:
+        """为已生成的输出文件及其上游规则源建立查询索引，规则统一以 classical 形式记录"""
+        start = time.perf_counter()
+        index = RuleIndex()
+        source_ids: Dict[tuple, int] = {}
+        try:
+            self._index_outputs(index, source_ids)
+        finally:
+            self._shutdown_process_pool()
+        index.finish()
+        self.logger.info(f"已建立查询索引, 共 {len(index.sets)} 个规则集合, 耗时 {time.perf_counter() - start:.2f}s")
+        return index
+
+    def _index_outputs(self, index: RuleIndex, source_ids: Dict[tuple, int]) -> None:
+        for config in self.config:
+            path = config.get('path')
+            if 'upstream' not in config or not path:
+                continue
+
+            upstream = {}
+            for name, source in config['upstream'].items():
+                key = self._source_key(source)
+                if key not in source_ids:
+                    source_ids[key] = index.add_set(kind='source', name=source.get('url') or source.get('path'))
+                    self._index_entries(index, source, source_ids[key])
+                upstream[name] = source_ids[key]
+
+            if not os.path.exists(path):
+                self.logger.warning(f"输出文件不存在, 仅索引其上游: {path}")
+                continue
+            output = {
+                'type': 'file',
+                'path': path,
+                'format': config.get('format', 'yaml'),
+                'behavior': self._get_source_behavior(config)
+            }
+            output_id = index.add_set(kind='output', name=path, upstream=upstream)
+            self._index_entries(index, output, output_id)
+
+    def _index_entries(self, index: RuleIndex, source: Dict, set_id: int) -> None:
+        # 域名不区分大小写，统一为小写，保证输出文件与上游中大小写不同的同一规则能够对应
+        entries = {
+            (kind, value.lower() if kind in ('domain', 'domain_suffix', 'domain_keyword') else value, options)
+            for kind, value, options in self._iter_entries(source)
+        }
+        for kind, value, options in entries:
+            rule = self._emit_entry((kind, value, options), 'classical', False)
+            if rule:
+                index.add(kind, value, rule, set_id)
+
+    def lookup(self, index: RuleIndex, query: str) -> List[Dict[str, Any]]:
+        """查询命中 query 的输出文件及规则，并列出同样命中 query 的上游"""
+        matches = index.query(query.strip())
+        # 输出规则可能经过 CIDR 聚合、后缀去重或 exclude 拆分，与上游规则不一定相同，按上游自身的查询结果对应
+        matched_sets = {set_id for _, set_id in matches}
+        results = []
+        for rule, set_id in sorted(set(matches), key=lambda item: (item[1], item[0])):
+            description = index.sets[set_id]
+            if description['kind'] != 'output':
+                continue
+            upstream = [
+                name for name, source_id in description['upstream'].items()
+                if source_id in matched_sets
+            ]
+            results.append({'path': description['name'], 'rule': rule, 'upstream': upstream})
+        return results
+
+    def _optimize_rules(
+        self,
+        output_path: str,
+        rules: List[str],
+        behavior: str,
+        optimize: List[str]
+    ) -> List[str]:
+        """按配置项 optimize 对合并后的规则做进一步精简"""
+        if 'suffix' in optimize and behavior in ('domain', 'classical'):
+            before = len(rules)
+            rules = self._dedup_covered_domains(rules, behavior)
+            self.logger.info(f"{output_path}: 后缀去重移除 {before - len(rules)} 条规则")
+        if 'keyword' in optimize and behavior in ('classical', 'sing-box'):
+            before = len(rules)
+            rules = self._prune_keyword_covered(rules, behavior)
+            self.logger.info(f"{output_path}: 关键词去重移除 {before - len(rules)} 条规则")
+        if 'cidr' in optimize and behavior in ('ipcidr', 'classical'):
+            before = len(rules)
+            rules = self._aggregate_cidr_rules(rules, behavior)
+            self.logger.info(f"{output_path}: CIDR 聚合 {before} -> {len(rules)} 条规则")
+        return rules
+
+    def _build_exclude_index(self, sources: Dict[str, Dict]) -> Dict[str, Any]:
+        """将 exclude 规则源建立为索引：精确域名集合、后缀前缀树、按版本合并后的有序 IP 区间及其他规则集合"""
+        domains = set()
+        suffixes = DomainSuffixTrie()
+        ranges: Dict[int, List[tuple[int, int, int]]] = {4: [], 6: []}
+        rules = set()
+        for source in sources.values():
+            for kind, value, _ in self._source_entries(source):
+                if kind == 'domain':
+                    domains.add(value.lower())
+                elif kind == 'domain_suffix':
+                    suffixes.add(value)
+                elif kind == 'ip_cidr':
+                    ip_range = self._cidr_to_range(value)
+                    if ip_range:
+                        ranges[ip_range[0]].append(ip_range)
+                else:
+                    rules.add((kind, value))
+
+        merged_ranges = {}
+        for version, items in ranges.items():
+            merged = self._merge_ranges(items)
+            merged_ranges[version] = ([start for start, _ in merged], [end for _, end in merged])
+        return {'domains': domains, 'suffixes': suffixes, 'ranges': merged_ranges, 'rules': rules}
+
+    def _exclude_rules(self, output_path: str, rules: Iterable[Any], behavior: str, index: Dict[str, Any]) -> set:
+        """从合并结果中减去 exclude 规则：域名按后缀语义匹配，CIDR 按区间相减并在需要时拆分"""
+        parsers = {
+            'classical': self._parse_classical_entry,
+            'domain': self._parse_domain_entry,
+            'ipcidr': self._parse_ipcidr_entry
+        }
+        before = removed = split = 0
+        kept_rules = set()
+        for rule in rules:
+            before += 1
+            if behavior == 'sing-box':
+                remaining = self._exclude_sing_box_rule(rule, index)
+                if remaining == [rule]:
+                    kept_rules.add(rule)
+                    continue
+            else:
+                entries = parsers[behavior](rule)
+                if len(entries) != 1:
+                    kept_rules.add(rule)
+                    continue
+                kind, value, options = entries[0]
+                remaining = self._exclude_value(kind, value, index)
+                if remaining is None:
+                    kept_rules.add(rule)
+                    continue
+                remaining = [self._emit_entry((kind, item, options), behavior, False) for item in remaining]
+
+            # 整条命中的规则移除，部分命中的规则 (如 CIDR 相减) 替换为剩余部分
+            if remaining:
+                split += 1
+            else:
+                removed += 1
+            kept_rules.update(remaining)
+        self.logger.info(
+            f"{output_path}: 排除规则整条移除 {removed} 条, 部分排除 {split} 条, {before} -> {len(kept_rules)} 条规则"
+        )
+        return kept_rules
+
+    def _exclude_sing_box_rule(self, rule: SingBoxRule, index: Dict[str, Any]) -> List[SingBoxRule]:
+        """sing-box 规则整条命中时移除；单字段规则逐值处理，含其他条件的规则无法部分排除，原样保留"""
+        if ('sing-box', rule) in index['rules']:
+            return []
+        if not self._can_compact_sing_box_rule(rule):
+            return [rule]
+
+        key, value = rule[0]
+        values = []
+        changed = False
+        for item in self._as_list(value):
+            remaining = self._exclude_value(key, item, index)
+            if remaining is None:
+                values.append(item)
+            else:
+                changed = True
+                values.extend(remaining)
+        if not changed:
+            return [rule]
+        return [SingBoxRule(((key, tuple(values)),))] if values else []
+
+    def _exclude_value(self, kind: str, value: str, index: Dict[str, Any]) -> Optional[List[str]]:
+        """返回排除后剩余的值，None 表示未命中、保留原值，空列表表示整条移除"""
+        if kind == 'domain':
+            if value.lower() in index['domains'] or index['suffixes'].covers(value):
+                return []
+            return None
+        if kind == 'domain_suffix':
+            # 后缀规则只在被同级或更上层的后缀覆盖时移除，无法只排除其中的部分子域名
+            return [] if index['suffixes'].covers(value.lstrip('.')) else None
+        if kind == 'ip_cidr':
+            ip_range = self._cidr_to_range(value)
+            if ip_range is None:
+                return None
+            pieces = self._subtract_ranges(ip_range, index['ranges'][ip_range[0]])
+            if pieces is None:
+                return None
+            return [cidr for start, end in pieces for cidr in self._range_to_cidrs(ip_range[0], start, end)]
+        return [] if (kind, value) in index['rules'] else None
+
+    def _subtract_ranges(
+        self,
+        ip_range: tuple[int, int, int],
+        excluded: tuple[List[int], List[int]]
+    ) -> Optional[List[tuple[int, int]]]:
+        """从区间中减去有序、互不重叠的排除区间，二分查找第一个可能重叠的区间；未重叠时返回 None"""
+        _, start, end = ip_range
+        starts, ends = excluded
+        index = bisect_left(ends, start)
+        if index == len(ends) or starts[index] > end:
+            return None
+
+        pieces = []
+        while index < len(starts) and starts[index] <= end:
+            if starts[index] > start:
+                pieces.append((start, starts[index] - 1))
+            start = ends[index] + 1
+            index += 1
+        if start <= end:
+            pieces.append((start, end))
+        return pieces
+
+    def _parse_domain_rule(self, rule: str, behavior: str) -> Optional[tuple[bool, str]]:
+        """解析域名规则，返回 (是否为后缀规则, 域名)；非域名规则返回 None"""
+        if behavior == 'domain':
+            if rule.startswith('+.'):
+                return True, rule[2:]
+            return False, rule
+
+        parts = rule.split(',')
+        if len(parts) != 2:
+            return None
+        if parts[0] == 'DOMAIN-SUFFIX':
+            return True, parts[1]
+        if parts[0] == 'DOMAIN':
+            return False, parts[1]
+        return None
+
+    def _dedup_covered_domains(self, rules: List[str], behavior: str) -> List[str]:
+        """移除已被同一输出中更宽泛的 DOMAIN-SUFFIX 覆盖的域名规则"""
+        parsed_rules = [self._parse_domain_rule(rule, behavior) for rule in rules]
+        trie = DomainSuffixTrie(parsed[1] for parsed in parsed_rules if parsed and parsed[0])
+
+        kept_rules = []
+        for rule, parsed in zip(rules, parsed_rules):
+            if parsed:
+                is_suffix, domain = parsed
+                if trie.covers(domain, include_self=not is_suffix):
+                    self.logger.debug(f"规则已被后缀覆盖: {rule}")
+                    continue
+            kept_rules.append(rule)
+        return kept_rules
+
+    def _prune_keyword_covered(self, rules: List[Any], behavior: str) -> List[Any]:
+        """移除包含某个 DOMAIN-KEYWORD 关键词的域名、后缀规则，这些规则命中的域名必然已被关键词规则命中"""
+        if behavior == 'sing-box':
+            return self._prune_sing_box_keyword_covered(rules)
+
+        automaton = KeywordAutomaton(
+            rule[15:] for rule in rules
+            if rule.startswith('DOMAIN-KEYWORD,') and rule.count(',') == 1
+        )
+        if not len(automaton):
+            return rules
+
+        kept_rules = []
+        for rule in rules:
+            parsed = self._parse_domain_rule(rule, behavior)
+            if parsed and automaton.search(parsed[1]):
+                self.logger.debug(f"规则已被关键词覆盖: {rule}")
+                continue
+            kept_rules.append(rule)
+        return kept_rules
+
+    def _prune_sing_box_keyword_covered(self, rules: List[SingBoxRule]) -> List[SingBoxRule]:
+        """sing-box 规则只使用单字段规则中的关键词，并逐值过滤单字段的 domain、domain_suffix 规则"""
+        compactable = [self._can_compact_sing_box_rule(rule) for rule in rules]
+        automaton = KeywordAutomaton(
+            keyword
+            for rule, simple in zip(rules, compactable)
+            if simple and rule[0][0] == 'domain_keyword'
+            for keyword in self._as_list(rule[0][1])
+        )
+        if not len(automaton):
+            return rules
+
+        kept_rules = []
+        for rule, simple in zip(rules, compactable):
+            key, value = rule[0] if simple else (None, None)
+            if key not in ('domain', 'domain_suffix'):
+                kept_rules.append(rule)
+                continue
+            values = self._as_list(value)
+            kept_values = tuple(item for item in values if not automaton.search(item))
+            if len(kept_values) == len(values):
+                kept_rules.append(rule)
+            elif kept_values:
+                kept_rules.append(SingBoxRule(((key, kept_values),)))
+        return kept_rules
+
+    def _aggregate_cidr_rules(self, rules: List[str], behavior: str) -> List[str]:
+        """合并重叠、相邻及被包含的 CIDR，IPv4 与 IPv6 分别聚合"""
+        # classical 规则按附加参数（如 no-resolve）分组，组内才能合并
+        groups: Dict[tuple, List[tuple[int, int, int]]] = {}
+        kept_rules = []
+        for rule in rules:
+            if behavior == 'ipcidr':
+                cidr, options = rule, ()
+            else:
+                parts = rule.split(',')
+                if len(parts) < 2 or parts[0] not in ('IP-CIDR', 'IP-CIDR6'):
+                    kept_rules.append(rule)
+                    continue
+                cidr, options = parts[1], tuple(parts[2:])
+
+            ip_range = self._cidr_to_range(cidr)
+            if ip_range is None:
+                kept_rules.append(rule)
+                continue
+            groups.setdefault((ip_range[0], options), []).append(ip_range)
+
+        for (version, options), ranges in groups.items():
+            for start, end in self._merge_ranges(ranges):
+                for cidr in self._range_to_cidrs(version, start, end):
+                    if behavior == 'ipcidr':
+                        kept_rules.append(cidr)
+                    else:
+                        rule_type = 'IP-CIDR6' if version == 6 else 'IP-CIDR'
+                        kept_rules.append(','.join((rule_type, cidr) + options))
+        return sorted(kept_rules)
+
+    def _cidr_to_range(self, cidr: str) -> Optional[tuple[int, int, int]]:
+        """将 CIDR 转换为 (版本, 起始地址, 结束地址) 整数区间"""
+        return parse_cidr(cidr)
+
+    def _merge_ranges(self, ranges: Iterable[tuple[int, int, int]]) -> List[tuple[int, int]]:
+        """排序后线性合并重叠或相邻的整数区间"""
+        merged: List[List[int]] = []
+        for _, start, end in sorted(ranges, key=lambda item: (item[1], item[2])):
+            if merged and start <= merged[-1][1] + 1:
+                if end > merged[-1][1]:
+                    merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        return [(start, end) for start, end in merged]
+
+    def _range_to_cidrs(self, version: int, start: int, end: int) -> List[str]:
+        """将整数区间拆分为最少数量的 CIDR"""
+        bits = 32 if version == 4 else 128
+        address_class = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+        cidrs = []
+        while start <= end:
+            # 起始地址对齐所允许的最大块与剩余区间长度所允许的最大块取较小者
+            align = (start & -start).bit_length() - 1 if start else bits
+            size = min(align, (end - start + 1).bit_length() - 1)
+            cidrs.append(f"{address_class(start)}/{bits - size}")
+            start += 1 << size
+        return cidrs
 
     def _write_rules(
         self,
@@ -317,69 +2489,75 @@ class RulesMerger:
         rule_format: str = 'yaml',
         behavior: str = 'classical',
         version: int = SING_BOX_RULESET_VERSION
-    ) -> None:
-        """写入规则到文件"""
+    ) -> bool:
+        """写入规则到文件，返回是否生成成功"""
         try:
             output_dir = os.path.dirname(output_path)
             if output_dir:
                 os.makedirs(output_dir, exist_ok=True)
 
             if rule_format == 'mrs':
-                tmp_path = self._make_temp_path('.tmp')
-                self._write_rules(tmp_path, rules, 'text', behavior, version)
-
-                try:
-                    if self._convert_to_mrs(tmp_path, output_path, behavior):
-                        self._log_generated_rule_file('mrs', output_path, len(rules))
-                    else:
-                        self.logger.error(f"生成 mrs 规则文件失败: {output_path}")
-                finally:
-                    if os.path.exists(tmp_path):
-                        os.unlink(tmp_path)
-                return
+                if not rules:
+                    # mihomo 无法生成、加载空的 mrs 规则集；删除旧文件，避免继续提供过期的规则
+                    self.logger.warning(f"规则为空, 跳过生成 mrs 规则文件: {output_path}")
+                    if os.path.exists(output_path):
+                        os.remove(output_path)
+                    return True
+                if self._write_mrs_file(output_path, rules, behavior, version):
+                    self._log_generated_rule_file('mrs', output_path, len(rules))
+                    return True
+                self.logger.error(f"生成 mrs 规则文件失败: {output_path}")
+                return False
 
             if rule_format == 'srs':
-                tmp_path = self._make_temp_path('.json')
-                self._write_sing_box_source(tmp_path, rules, behavior, version)
-
-                try:
-                    if self._convert_to_srs(tmp_path, output_path):
-                        self._log_generated_rule_file('srs', output_path, len(rules))
-                    else:
-                        self.logger.error(f"生成 srs 规则文件失败: {output_path}")
-                finally:
-                    if os.path.exists(tmp_path):
-                        os.unlink(tmp_path)
-                return
+                rule_set = self._to_sing_box_rules(rules, behavior)
+                if self._write_srs_file(output_path, rule_set, version):
+                    self._log_generated_rule_file('srs', output_path, len(rules))
+                    return True
+                self.logger.error(f"生成 srs 规则文件失败: {output_path}")
+                return False
 
             if rule_format == 'json':
                 self._write_sing_box_source(output_path, rules, behavior, version)
                 self._log_generated_rule_file('json', output_path, len(rules))
-                return
+                return True
             
+            if behavior == 'sing-box':
+                rules = sorted(rule.to_json() for rule in rules)
             with open(output_path, 'w', encoding='utf-8') as f:
                 if not output_path.endswith('.tmp'):
                     f.write(f"# 更新时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
                     f.write(f"# 规则数量: {len(rules)}\n")
                 if rule_format == 'yaml':
-                    yaml_str = yaml.dump(
-                        {'payload': rules}, 
-                        allow_unicode=True, 
-                        indent=2,
-                        default_flow_style=False,
-                        sort_keys=False
-                    )
-                    formatted_yaml = yaml_str.replace('\n-', '\n  -')
-                    f.write(formatted_yaml)
+                    self._write_yaml_payload(f, rules)
+                elif isinstance(rules, PackedRuleSet):
+                    for block in rules.iter_text():
+                        f.write(block)
                 else:
                     for rule in rules:
                         f.write(f"{rule}\n")
             if not output_path.endswith('.tmp'):
                 self._log_generated_rule_file(rule_format, output_path, len(rules))
+            return True
         except Exception as e:
             self.logger.error(f"写入规则文件失败: {str(e)}", exc_info=True)
             raise
 
+    def _write_yaml_payload(self, f: io.TextIOBase, rules: List[str]) -> None:
+        """逐条写入 payload 列表，输出与 yaml.dump 加缩进处理后的结果一致"""
+        if not rules:
+            f.write('payload: []\n')
+            return
+
+        f.write('payload:\n')
+        for rule in rules:
+            if YAML_PLAIN_PATTERN.match(rule) and not rule.endswith(':') and not self._has_implicit_yaml_type(rule):
+                f.write(f"  - {rule}\n")
+                continue
+            # 需要引号或转义的规则交由 yaml.dump 处理
+            item = yaml.dump([rule], allow_unicode=True, indent=2, default_flow_style=False)
+            f.write(('\n' + item).replace('\n-', '\n  -')[1:])
+
     def _log_generated_rule_file(self, rule_format: str, output_path: str, rule_count: int) -> None:
         self.logger.info(f"已生成 {rule_format} 规则文件: {output_path}, 共 {rule_count} 条规则")
 
@@ -391,31 +2569,31 @@ class RulesMerger:
         version: int = SING_BOX_RULESET_VERSION
     ) -> None:
         """写入 sing-box source rule-set JSON。"""
+        self._dump_sing_box_source(output_path, self._to_sing_box_rules(rules, behavior), version)
+
+    def _dump_sing_box_source(self, output_path: str, rules: List[Dict[str, Any]], version: int) -> None:
         rule_set = {
             'version': version,
-            'rules': self._to_sing_box_rules(rules, behavior)
+            'rules': rules
         }
         with open(output_path, 'w', encoding='utf-8') as f:
             json.dump(rule_set, f, ensure_ascii=False, indent=2)
             f.write('\n')
 
-    def _to_sing_box_rules(self, rules: List[str], behavior: str) -> List[Dict[str, Any]]:
+    def _to_sing_box_rules(self, rules: List[Any], behavior: str) -> List[Dict[str, Any]]:
         """将当前规则转换为 sing-box headless rule。"""
         sing_box_rule = self._new_sing_box_rule_bucket()
 
         if behavior == 'sing-box':
             passthrough_rules = []
             for rule in rules:
-                parsed_rule = self._parse_sing_box_rule(rule)
-                if parsed_rule is None:
-                    self.logger.debug(f"跳过无法解析的 sing-box 规则: {rule}")
-                    continue
-                if self._can_compact_sing_box_rule(parsed_rule):
-                    self._add_sing_box_rule_items(sing_box_rule, parsed_rule)
+                if self._can_compact_sing_box_rule(rule):
+                    self._add_sing_box_rule_items(sing_box_rule, rule)
                 else:
-                    passthrough_rules.append(parsed_rule)
+                    passthrough_rules.append(rule)
 
-            return self._compact_sing_box_rules(sing_box_rule) + passthrough_rules
+            passthrough_rules.sort(key=SingBoxRule.sort_key)
+            return self._compact_sing_box_rules(sing_box_rule) + [rule.to_dict() for rule in passthrough_rules]
 
         for rule in rules:
             converted = self._to_sing_box_item(rule, behavior)
@@ -430,14 +2608,11 @@ class RulesMerger:
     def _new_sing_box_rule_bucket(self) -> Dict[str, List[str]]:
         return {key: [] for key in SING_BOX_LIST_FIELDS}
 
-    def _can_compact_sing_box_rule(self, rule: Dict[str, Any]) -> bool:
-        if rule.get('type') == 'logical':
-            return False
-
+    def _can_compact_sing_box_rule(self, rule: SingBoxRule) -> bool:
         if len(rule) != 1:
             return False
 
-        key, value = next(iter(rule.items()))
+        key, value = rule[0]
         values = self._as_list(value)
         return (
             key in SING_BOX_LIST_FIELDS and
@@ -445,9 +2620,9 @@ class RulesMerger:
             all(isinstance(item, str) for item in values)
         )
 
-    def _add_sing_box_rule_items(self, bucket: Dict[str, List[str]], rule: Dict[str, Any]) -> None:
-        for key in SING_BOX_LIST_FIELDS:
-            bucket[key].extend(self._as_list(rule.get(key)))
+    def _add_sing_box_rule_items(self, bucket: Dict[str, List[str]], rule: SingBoxRule) -> None:
+        key, value = rule[0]
+        bucket[key].extend(self._as_list(value))
 
     def _compact_sing_box_rules(self, bucket: Dict[str, List[str]]) -> List[Dict[str, List[str]]]:
         return [
@@ -474,157 +2649,51 @@ class RulesMerger:
 
         rule_type = parts[0]
         value = parts[1]
-        mapping = {
-            'DOMAIN': 'domain',
-            'DOMAIN-SUFFIX': 'domain_suffix',
-            'DOMAIN-KEYWORD': 'domain_keyword',
-            'DOMAIN-REGEX': 'domain_regex',
-            'IP-CIDR': 'ip_cidr',
-            'IP-CIDR6': 'ip_cidr'
-        }
-        target_key = mapping.get(rule_type)
+        target_key = CLASSICAL_TO_SING_BOX.get(rule_type)
         if not target_key:
             return None
         return target_key, value
 
-    def _read_sing_box_source(self, content: str) -> List[str]:
+    def _read_sing_box_source(self, content: str) -> List[SingBoxRule]:
         """读取 sing-box source rule-set JSON，返回规范化 headless rule。"""
         try:
-            data = json.loads(content.lstrip('\ufeff'))
+            data = json.loads(content.lstrip('\ufeff'), object_pairs_hook=SingBoxRule.from_pairs)
         except json.JSONDecodeError as e:
             self.logger.error(f"sing-box json 解析失败: {e}")
             return []
 
-        if not isinstance(data, dict):
+        if not isinstance(data, SingBoxRule):
             self.logger.error("sing-box json 顶层必须是对象")
             return []
 
-        rules = data.get('rules', [])
-        if not isinstance(rules, list):
+        rules = data.get('rules', ())
+        if type(rules) is not tuple:
             self.logger.error("sing-box json rules 必须是列表")
             return []
 
-        normalized_rules = []
-        for rule in rules:
-            normalized_rule = self._normalize_sing_box_rule(rule)
-            if normalized_rule:
-                normalized_rules.append(normalized_rule)
-        return normalized_rules
+        return [rule for rule in rules if isinstance(rule, SingBoxRule) and rule]
 
-    def _normalize_sing_box_rule(self, rule: Any) -> Optional[str]:
-        """将 sing-box headless rule 规范化为可去重的 JSON 字符串。"""
+    def _normalize_sing_box_rule(self, rule: Any) -> Optional[SingBoxRule]:
+        """将 sing-box headless rule 冻结为可去重的 SingBoxRule。"""
         if not isinstance(rule, dict):
             return None
-        return json.dumps(rule, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return SingBoxRule.from_dict(rule)
 
-    def _parse_sing_box_rule(self, rule: str) -> Optional[Dict[str, Any]]:
+    def _parse_sing_box_rule(self, rule: Any) -> Optional[SingBoxRule]:
+        """json / srs 规则源已冻结为 SingBoxRule，其他格式的规则源按行解析 JSON"""
+        if isinstance(rule, SingBoxRule):
+            return rule
         try:
             parsed = json.loads(rule)
         except (TypeError, json.JSONDecodeError):
             return None
-        return parsed if isinstance(parsed, dict) else None
-
-    def _validate_sing_box_rule(self, rule: str) -> Optional[str]:
-        parsed = self._parse_sing_box_rule(rule)
-        if parsed is None:
-            self.logger.debug(f"sing-box 规则验证失败: {rule}")
-            return None
         return self._normalize_sing_box_rule(parsed)
 
-    def _classical_to_sing_box(self, rule: str) -> Optional[str]:
-        if not self._validate_classical_rule(rule):
-            return None
-        item = self._to_sing_box_item(rule, 'classical')
-        if not item:
-            return None
-        key, value = item
-        return self._normalize_sing_box_rule({key: [value]})
-
-    def _domain_to_sing_box(self, rule: str) -> Optional[str]:
-        if not self._validate_domain_rule(rule):
-            return None
-        item = self._to_sing_box_item(rule, 'domain')
-        if not item:
-            return None
-        key, value = item
-        return self._normalize_sing_box_rule({key: [value]})
-
-    def _ipcidr_to_sing_box(self, rule: str) -> Optional[str]:
-        if not self._validate_ipcidr_rule(rule):
-            return None
-        item = self._to_sing_box_item(rule, 'ipcidr')
-        if not item:
-            return None
-        key, value = item
-        return self._normalize_sing_box_rule({key: [value]})
-
-    def _sing_box_to_domain(self, rule: str) -> List[str]:
-        parsed = self._parse_sing_box_rule(rule)
-        if parsed is None:
-            return []
-
-        rules = []
-        for item in self._iter_sing_box_rules(parsed):
-            for domain in self._as_list(item.get('domain')):
-                if isinstance(domain, str) and self._validate_domain_rule(domain):
-                    rules.append(domain)
-            for suffix in self._as_list(item.get('domain_suffix')):
-                if isinstance(suffix, str):
-                    suffix = suffix[1:] if suffix.startswith('.') else suffix
-                    domain_rule = f"+.{suffix}"
-                    if self._validate_domain_rule(domain_rule):
-                        rules.append(domain_rule)
-        return rules
-
-    def _sing_box_to_ipcidr(self, rule: str) -> List[str]:
-        parsed = self._parse_sing_box_rule(rule)
-        if parsed is None:
-            return []
-
-        rules = []
-        for item in self._iter_sing_box_rules(parsed):
-            for ipcidr in self._as_list(item.get('ip_cidr')):
-                if isinstance(ipcidr, str) and self._validate_ipcidr_rule(ipcidr):
-                    rules.append(ipcidr)
-        return rules
-
-    def _sing_box_to_classical(self, rule: str) -> List[str]:
-        parsed = self._parse_sing_box_rule(rule)
-        if parsed is None:
-            return []
-
-        rules = []
-        for item in self._iter_sing_box_rules(parsed):
-            for domain in self._as_list(item.get('domain')):
-                if isinstance(domain, str):
-                    classical_rule = f"DOMAIN,{domain}"
-                    if self._validate_classical_rule(classical_rule):
-                        rules.append(classical_rule)
-            for suffix in self._as_list(item.get('domain_suffix')):
-                if isinstance(suffix, str):
-                    suffix = suffix[1:] if suffix.startswith('.') else suffix
-                    classical_rule = f"DOMAIN-SUFFIX,{suffix}"
-                    if self._validate_classical_rule(classical_rule):
-                        rules.append(classical_rule)
-            for keyword in self._as_list(item.get('domain_keyword')):
-                if isinstance(keyword, str):
-                    rules.append(f"DOMAIN-KEYWORD,{keyword}")
-            for regex_rule in self._as_list(item.get('domain_regex')):
-                if isinstance(regex_rule, str):
-                    rules.append(f"DOMAIN-REGEX,{regex_rule}")
-            for ipcidr in self._as_list(item.get('ip_cidr')):
-                if not isinstance(ipcidr, str):
-                    continue
-                classical_rule = f"IP-CIDR6,{ipcidr}" if ':' in ipcidr else f"IP-CIDR,{ipcidr}"
-                if self._validate_classical_rule(classical_rule):
-                    rules.append(classical_rule)
-        return rules
-
-    def _iter_sing_box_rules(self, rule: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def _iter_sing_box_rules(self, rule: SingBoxRule) -> List[SingBoxRule]:
         rules = [rule]
         if rule.get('type') == 'logical':
             for nested_rule in self._as_list(rule.get('rules')):
-                if isinstance(nested_rule, dict):
+                if isinstance(nested_rule, SingBoxRule):
                     rules.extend(self._iter_sing_box_rules(nested_rule))
         return rules
 
@@ -633,55 +2702,39 @@ class RulesMerger:
             return []
         if isinstance(value, list):
             return value
+        if type(value) is tuple:
+            return list(value)
         return [value]
     
-    def _validate_classical_rule(self, rule: str) -> Optional[str]:
-        """验证经典规则格式"""
-        try:
-            parts = rule.split(',')
-            if len(parts) < 2:
-                return None
-                
-            rule_type = parts[0]
-            value = parts[1].strip()
-
-            rule = ','.join(part.strip() for part in parts)
-                
-            if rule_type in {'DOMAIN', 'DOMAIN-SUFFIX'}:
-                return rule if DOMAIN_PATTERN.match(value) else None
-            elif rule_type == 'IP-CIDR':
-                return rule if self._get_ipcidr_version(value) == 4 else None
-            elif rule_type == 'IP-CIDR6':
-                return rule if self._get_ipcidr_version(value) == 6 else None
-            return rule
-        except Exception as e:
-            self.logger.debug(f"规则验证失败: {rule}, 错误: {str(e)}")
-            return None
-
-    def _validate_ipcidr_rule(self, rule: str) -> Optional[str]:
-        """验证 IP-CIDR 规则格式"""
-        if self._get_ipcidr_version(rule):
-            return rule
-        self.logger.debug(f"IP-CIDR 规则验证失败: {rule}")
-        return None
-
     def _get_ipcidr_version(self, rule: str) -> Optional[int]:
-        try:
-            return ipaddress.ip_network(rule, strict=False).version
-        except ValueError:
-            return None
-
-    def _validate_domain_rule(self, rule: str) -> Optional[str]:
-        """验证域名规则格式"""
-        # +.example.com 形式的 suffix 规则需要去掉前缀再验证
-        domain = rule[2:] if rule.startswith('+.') else rule
-        if DOMAIN_PATTERN.match(domain):
-            return rule
-        self.logger.debug(f"域名规则验证失败: {rule}")
-        return None
+        parsed = parse_cidr(rule)
+        return parsed[0] if parsed else None
 
     def _read_mrs_file(self, input_path: str, behavior: str) -> List[str]:
         """读取mrs文件"""
+        with open(input_path, 'rb') as f:
+            return self._read_mrs_content(f.read(), behavior, input_path)
+
+    def _read_mrs_content(self, content: bytes, behavior: str, source: str) -> List[str]:
+        """解析 mrs 内容，未安装 zstandard 时改用 mihomo 解码"""
+        if zstandard is None:
+            tmp_path = self._make_temp_path('.mrs')
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(content)
+                return self._decompile_mrs_file(tmp_path, behavior)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+        try:
+            return self._decode_mrs(content, behavior)
+        except (ValueError, zstandard.ZstdError) as e:
+            self.logger.error(f"读取mrs失败 {source}: {e}")
+            return []
+
+    def _decompile_mrs_file(self, input_path: str, behavior: str) -> List[str]:
+        """使用 mihomo 解码 mrs 文件"""
         if not self.mihomo_path:
             self.logger.warning("未找到 mihomo，无法读取mrs文件")
             return []
@@ -710,8 +2763,185 @@ class RulesMerger:
                 except OSError as e:
                     self.logger.debug(f"清理临时文件失败 {output_path}: {e}")
 
-    def _read_srs_file(self, input_path: str) -> List[str]:
+    def _write_mrs_file(self, output_path: str, rules: List[str], behavior: str, version: int) -> bool:
+        """直接编码生成 mrs 文件，未安装 zstandard 时改用 mihomo 转换"""
+        if zstandard is None:
+            tmp_path = self._make_temp_path('.tmp')
+            self._write_rules(tmp_path, rules, 'text', behavior, version)
+            try:
+                return self._convert_to_mrs(tmp_path, output_path, behavior)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+        try:
+            data = self._encode_mrs(rules, behavior)
+        except ValueError as e:
+            self.logger.error(f"生成 mrs 失败: {e}")
+            return False
+        if MRS_VERIFY and not self._verify_mrs_content(output_path, data, rules, behavior):
+            self._record_verify_failure(output_path)
+            return False
+        self._atomic_write(output_path, data)
+        return True
+
+    def _verify_mrs_content(self, path: str, data: bytes, rules: Iterable[str], behavior: str) -> bool:
+        """原生解码结果应与待写入的规则一致，mihomo 解码结果应与原生解码一致"""
+        native_rules = self._canonical_mrs_rules(self._decode_mrs(data, behavior), behavior)
+        if native_rules != self._canonical_mrs_rules(rules, behavior):
+            self.logger.error(f"mrs 校验失败, 原生解码与待写入的规则不一致: {path}")
+            return False
+
+        tmp_path = self._make_temp_path('.mrs')
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            decompiled_rules = self._decompile_mrs_file(tmp_path, behavior)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        if self._canonical_mrs_rules(decompiled_rules, behavior) != native_rules:
+            self.logger.error(f"mrs 校验失败, mihomo 解码结果与原生解码不一致: {path}")
+            return False
+        return True
+
+    def _canonical_mrs_rules(self, rules: Iterable[str], behavior: str) -> Any:
+        """按 mrs 的存储方式规范化规则用于比对：域名转小写并去掉被 +. 通配覆盖的根域名，CIDR 按版本合并为地址区间"""
+        if behavior == 'ipcidr':
+            ranges = [parsed for parsed in map(parse_cidr, rules) if parsed]
+            return [self._merge_ranges(item for item in ranges if item[0] == version) for version in (4, 6)]
+        domains = {rule.lower() for rule in rules}
+        return domains - {domain[2:] for domain in domains if domain.startswith('+.')}
+
+    def _encode_mrs(self, rules: List[str], behavior: str) -> bytes:
+        """按 mihomo convert-ruleset 的逻辑将 domain / ipcidr 规则编码为 mrs"""
+        if behavior not in MRS_BEHAVIORS:
+            raise ValueError(f"mrs格式仅支持domain/ipcidr: {behavior}")
+
+        body = bytearray()
+        if behavior == 'domain':
+            count = self._write_mrs_domain_set(body, rules)
+        else:
+            count = self._write_mrs_ip_set(body, rules)
+        if count == 0:
+            raise ValueError("规则为空")
+
+        header = MRS_MAGIC + bytes([MRS_BEHAVIORS[behavior]]) + struct.pack('>qq', count, 0)
+        compressor = zstandard.ZstdCompressor(level=MRS_COMPRESSION_LEVEL)
+        return compressor.compress(header + bytes(body))
+
+    def _write_mrs_domain_set(self, buffer: bytearray, rules: List[str]) -> int:
+        """按 mihomo DomainTrie 的展开方式生成反转域名的 succinct set，返回有效规则数"""
+        # 直接保存反转、编码后的键，排序结果与集合共用同一批 bytes 对象
+        keys = set()
+        count = 0
+        for rule in rules:
+            parts = rule.lower().split('.')
+            if rule.endswith('.') or not parts[0] and len(parts) == 1 or not all(parts[1:]):
+                self.logger.debug(f"跳过无效的 mrs 域名规则: {rule}")
+                continue
+            if parts[0] == '+':
+                if len(parts) == 1:
+                    continue
+                keys.add('.'.join(parts[1:])[::-1].encode('utf-8'))
+                parts[0] = ''
+            domain = '.'.join(parts)
+            # mihomo 将以 . 开头的节点统一记为 +. 通配
+            key = '+' + domain if domain.startswith('.') else domain
+            keys.add(key[::-1].encode('utf-8'))
+            count += 1
+
+        encoded_keys = sorted(keys)
+        del keys
+        leaves, label_bitmap, labels = self._build_succinct_set(encoded_keys) if encoded_keys else ([], [], b'')
+
+        buffer.append(1)
+        for words in (leaves, label_bitmap):
+            buffer += struct.pack(f'>q{len(words)}Q', len(words), *words)
+        buffer += struct.pack('>q', len(labels)) + labels
+        return count
+
+    def _write_mrs_ip_set(self, buffer: bytearray, rules: List[str]) -> int:
+        """写入合并后的 IP 区间，IPv4 以 IPv4-mapped 形式存储，返回有效规则数"""
+        ranges = {4: [], 6: []}
+        for rule in rules:
+            ip_range = self._cidr_to_range(rule) if '/' in rule else None
+            if ip_range is None:
+                self.logger.debug(f"跳过无效的 mrs IP-CIDR 规则: {rule}")
+                continue
+            ranges[ip_range[0]].append(ip_range)
+
+        merged = [(version, self._merge_ranges(ranges[version])) for version in (4, 6)]
+        buffer.append(1)
+        buffer += struct.pack('>q', sum(len(items) for _, items in merged))
+        for version, items in merged:
+            mapped = 0xFFFF << 32 if version == 4 else 0
+            for start, end in items:
+                buffer += (mapped | start).to_bytes(16, 'big') + (mapped | end).to_bytes(16, 'big')
+        return len(ranges[4]) + len(ranges[6])
+
+    def _decode_mrs(self, content: bytes, behavior: str) -> List[str]:
+        """将 mrs 解码为 text 规则，输出与 mihomo convert-ruleset 一致"""
+        reader = BinaryReader(zstandard.ZstdDecompressor().decompressobj().decompress(content))
+        if reader.read(4) != MRS_MAGIC:
+            raise ValueError("不是有效的 mrs 文件")
+        if reader.read_byte() != MRS_BEHAVIORS.get(behavior):
+            raise ValueError(f"mrs 规则类型与 {behavior} 不一致")
+        reader.read(8)
+        reader.read(struct.unpack('>q', reader.read(8))[0])
+        if reader.read_byte() != 1:
+            raise ValueError("未知的 mrs 数据版本")
+
+        if behavior == 'ipcidr':
+            rules = []
+            for _ in range(struct.unpack('>q', reader.read(8))[0]):
+                ip_range = [int.from_bytes(reader.read(16), 'big') for _ in range(2)]
+                if all(value >> 32 == 0xFFFF for value in ip_range):
+                    rules.extend(self._range_to_cidrs(4, ip_range[0] & 0xFFFFFFFF, ip_range[1] & 0xFFFFFFFF))
+                else:
+                    rules.extend(self._range_to_cidrs(6, *ip_range))
+            return rules
+
+        words = []
+        for _ in range(2):
+            length = struct.unpack('>q', reader.read(8))[0]
+            words.append(list(struct.unpack(f'>{length}Q', reader.read(length * 8))))
+        leaves, label_bitmap = words
+        labels = reader.read(struct.unpack('>q', reader.read(8))[0])
+        keys = sorted(key.decode('utf-8')[::-1] for key in self._succinct_set_keys(leaves, label_bitmap, labels))
+        # 跳过 +. 通配展开时插入的根域名
+        wildcards = {key[2:] for key in keys if key.startswith('+.')}
+        return [key for key in keys if key not in wildcards]
+
+    def _read_srs_file(self, input_path: str) -> List[SingBoxRule]:
         """读取 sing-box srs 文件。"""
+        with open(input_path, 'rb') as f:
+            return self._read_srs_content(f.read(), input_path)
+
+    def _read_srs_content(self, content: bytes, source: str) -> List[SingBoxRule]:
+        """解析 srs 内容，遇到不支持的规则项时改用 sing-box 解码"""
+        try:
+            rules = self._decode_srs(content)
+        except (ValueError, zlib.error) as e:
+            self.logger.warning(f"原生解析 srs 失败, 改用 sing-box {source}: {e}")
+            tmp_path = self._make_temp_path('.srs')
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(content)
+                return self._decompile_srs_file(tmp_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+        normalized_rules = []
+        for rule in rules:
+            normalized_rule = self._normalize_sing_box_rule(rule)
+            if normalized_rule:
+                normalized_rules.append(normalized_rule)
+        return normalized_rules
+
+    def _decompile_srs_file(self, input_path: str) -> List[SingBoxRule]:
+        """使用 sing-box 解码 srs 文件。"""
         if not self.sing_box_path:
             self.logger.warning("未找到 sing-box，无法读取srs文件")
             return []
@@ -738,6 +2968,351 @@ class RulesMerger:
                 except OSError as e:
                     self.logger.debug(f"清理临时文件失败 {output_path}: {e}")
 
+    def _write_srs_file(self, output_path: str, rules: List[Dict[str, Any]], version: int) -> bool:
+        """直接编码生成 srs 文件，遇到不支持的规则项时改用 sing-box 编译"""
+        try:
+            data = self._encode_srs(rules, version)
+        except ValueError as e:
+            self.logger.warning(f"原生生成 srs 失败, 改用 sing-box {output_path}: {e}")
+            tmp_path = self._make_temp_path('.json')
+            try:
+                self._dump_sing_box_source(tmp_path, rules, version)
+                return self._convert_to_srs(tmp_path, output_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+        if SRS_VERIFY and not self._verify_srs_content(output_path, data, rules):
+            self._record_verify_failure(output_path)
+            return False
+        self._atomic_write(output_path, data)
+        return True
+
+    def _verify_srs_content(self, path: str, data: bytes, rules: List[Dict[str, Any]]) -> bool:
+        """原生解码结果应与待写入的规则一致，sing-box 解码结果应与原生解码一致"""
+        native_rules = self._read_srs_content(data, path)
+        if set(map(self._canonical_srs_rule, native_rules)) != set(map(self._canonical_srs_rule, rules)):
+            self.logger.error(f"srs 校验失败, 原生解码与待写入的规则不一致: {path}")
+            return False
+
+        tmp_path = self._make_temp_path('.srs')
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            decompiled_rules = self._decompile_srs_file(tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        # sing-box 反编译时单元素列表输出为标量，同样规范化后再比对
+        if set(map(self._canonical_srs_rule, decompiled_rules)) != set(map(self._canonical_srs_rule, native_rules)):
+            self.logger.error(f"srs 校验失败, sing-box 解码结果与原生解码不一致: {path}")
+            return False
+        return True
+
+    def _canonical_srs_rule(self, rule: Any) -> tuple:
+        """按 srs 的存储方式规范化规则用于比对：去掉默认值，规则项统一为去重排序的列表，ip_cidr 按版本合并为地址区间"""
+        if isinstance(rule, SingBoxRule):
+            rule = rule.to_dict()
+        items = []
+        for key, value in rule.items():
+            # srs 不保存默认值
+            if key == 'invert' and not value or key == 'type' and value == 'default':
+                continue
+            if key == 'rules':
+                value = tuple(self._canonical_srs_rule(sub_rule) for sub_rule in self._as_list(value))
+            elif key in ('ip_cidr', 'source_ip_cidr'):
+                ranges = [parsed for parsed in map(parse_cidr, self._as_list(value)) if parsed]
+                value = tuple(
+                    tuple(self._merge_ranges(item for item in ranges if item[0] == version))
+                    for version in (4, 6)
+                )
+            elif key not in ('type', 'mode', 'invert'):
+                value = tuple(sorted(set(self._as_list(value))))
+            items.append((key, value))
+        return tuple(sorted(items, key=itemgetter(0)))
+
+    def _record_verify_failure(self, path: str) -> None:
+        with self._cache_lock:
+            self.verify_failures.append(path)
+
+    def _encode_srs(self, rules: List[Dict[str, Any]], version: int) -> bytes:
+        """将 sing-box headless rule 编码为 srs 二进制规则集"""
+        body = bytearray(encode_uvarint(len(rules)))
+        for rule in rules:
+            self._write_srs_rule(body, rule, version)
+        return SRS_MAGIC + bytes([version]) + zlib.compress(bytes(body), 9)
+
+    def _write_srs_rule(self, buffer: bytearray, rule: Dict[str, Any], version: int) -> None:
+        if rule.get('type') == 'logical':
+            mode = {'and': 0, 'or': 1}.get(rule.get('mode'))
+            if mode is None:
+                raise ValueError(f"不支持的逻辑规则模式: {rule.get('mode')}")
+            sub_rules = self._as_list(rule.get('rules'))
+            buffer += bytes([1, mode])
+            buffer += encode_uvarint(len(sub_rules))
+            for sub_rule in sub_rules:
+                if not isinstance(sub_rule, dict):
+                    raise ValueError("逻辑规则的子规则必须是对象")
+                self._write_srs_rule(buffer, sub_rule, version)
+            buffer.append(1 if rule.get('invert') else 0)
+            return
+
+        supported_keys = {'type', 'invert', 'domain_suffix'} | {key for key, _, _ in SRS_RULE_ITEMS}
+        unsupported_keys = set(rule) - supported_keys
+        if unsupported_keys or rule.get('type', 'default') != 'default':
+            raise ValueError(f"不支持的规则字段: {sorted(unsupported_keys) or rule.get('type')}")
+
+        buffer.append(0)
+        for key, item_type, value_type in SRS_RULE_ITEMS:
+            if value_type == 'domain':
+                domains = self._as_str_list(rule.get('domain'))
+                suffixes = self._as_str_list(rule.get('domain_suffix'))
+                if domains or suffixes:
+                    buffer.append(item_type)
+                    self._write_srs_domain_set(buffer, domains, suffixes, version == 1)
+                continue
+
+            values = self._as_list(rule.get(key))
+            if not values:
+                continue
+            buffer.append(item_type)
+            if value_type == 'ip':
+                self._write_srs_ip_set(buffer, self._as_str_list(values))
+            elif value_type == 'uint16':
+                if not all(isinstance(value, int) and 0 <= value <= 0xFFFF for value in values):
+                    raise ValueError(f"{key} 必须是端口号")
+                buffer += encode_uvarint(len(values))
+                buffer += struct.pack(f'>{len(values)}H', *values)
+            else:
+                values = self._as_str_list(values)
+                buffer += encode_uvarint(len(values))
+                for value in values:
+                    encoded = value.encode('utf-8')
+                    buffer += encode_uvarint(len(encoded)) + encoded
+
+        buffer.append(SRS_ITEM_FINAL)
+        buffer.append(1 if rule.get('invert') else 0)
+
+    def _as_str_list(self, value: Any) -> List[str]:
+        values = self._as_list(value)
+        if not all(isinstance(item, str) for item in values):
+            raise ValueError("规则值必须是字符串")
+        return values
+
+    def _write_srs_domain_set(
+        self,
+        buffer: bytearray,
+        domains: List[str],
+        suffixes: List[str],
+        legacy: bool
+    ) -> None:
+        """按 sing-box domain.NewMatcher 的规则生成反转域名的 succinct set"""
+        keys = []
+        seen = set()
+        for suffix in suffixes:
+            if suffix in seen:
+                continue
+            seen.add(suffix)
+            if suffix.startswith('.'):
+                keys.append(SRS_DOMAIN_SUFFIX_LABEL + suffix)
+            elif legacy:
+                keys.append(suffix)
+                if '.' + suffix not in seen:
+                    seen.add('.' + suffix)
+                    keys.append(SRS_DOMAIN_SUFFIX_LABEL + '.' + suffix)
+            else:
+                keys.append(SRS_DOMAIN_ROOT_LABEL + suffix)
+        for domain in domains:
+            if domain in seen:
+                continue
+            seen.add(domain)
+            keys.append(domain)
+
+        encoded_keys = sorted({key[::-1].encode('utf-8') for key in keys})
+        leaves, label_bitmap, labels = self._build_succinct_set(encoded_keys)
+
+        buffer.append(0)
+        for words in (leaves, label_bitmap):
+            buffer += encode_uvarint(len(words))
+            buffer += struct.pack(f'>{len(words)}Q', *words)
+        buffer += encode_uvarint(len(labels)) + labels
+
+    def _build_succinct_set(self, keys: List[bytes]) -> tuple[List[int], List[int], bytes]:
+        """按广度优先构建 LOUDS 编码的前缀树，keys 需已排序去重"""
+        leaves: List[int] = []
+        label_bitmap: List[int] = []
+        labels = bytearray()
+
+        def set_bit(bitmap: List[int], index: int, value: int) -> None:
+            while index >> 6 >= len(bitmap):
+                bitmap.append(0)
+            bitmap[index >> 6] |= value << (index & 63)
+
+        # 按层展开，同层节点的列号相同，只需保存本层各节点对应的 keys 区间
+        label_index = 0
+        node = 0
+        column = 0
+        level_starts = array('Q', [0])
+        level_ends = array('Q', [len(keys)])
+        while level_starts:
+            next_starts = array('Q')
+            next_ends = array('Q')
+            for start, end in zip(level_starts, level_ends):
+                if column == len(keys[start]):
+                    start += 1
+                    set_bit(leaves, node, 1)
+                index = start
+                while index < end:
+                    first = index
+                    label = keys[first][column]
+                    while index < end and keys[index][column] == label:
+                        index += 1
+                    next_starts.append(first)
+                    next_ends.append(index)
+                    labels.append(label)
+                    set_bit(label_bitmap, label_index, 0)
+                    label_index += 1
+                set_bit(label_bitmap, label_index, 1)
+                label_index += 1
+                node += 1
+            level_starts, level_ends = next_starts, next_ends
+            column += 1
+        return leaves, label_bitmap, bytes(labels)
+
+    def _write_srs_ip_set(self, buffer: bytearray, cidrs: List[str]) -> None:
+        """写入合并后的 IP 区间，IPv4 在前"""
+        ranges = {4: [], 6: []}
+        for cidr in cidrs:
+            ip_range = self._cidr_to_range(cidr)
+            if ip_range is None:
+                raise ValueError(f"无效的 IP-CIDR: {cidr}")
+            ranges[ip_range[0]].append(ip_range)
+
+        merged = [(version, self._merge_ranges(ranges[version])) for version in (4, 6)]
+        buffer.append(1)
+        buffer += struct.pack('>Q', sum(len(items) for _, items in merged))
+        for version, items in merged:
+            size = 4 if version == 4 else 16
+            for start, end in items:
+                buffer += encode_uvarint(size) + start.to_bytes(size, 'big')
+                buffer += encode_uvarint(size) + end.to_bytes(size, 'big')
+
+    def _decode_srs(self, content: bytes) -> List[Dict[str, Any]]:
+        """将 srs 二进制规则集解码为 sing-box headless rule"""
+        if content[:3] != SRS_MAGIC or len(content) < 4:
+            raise ValueError("不是有效的 srs 文件")
+        reader = BinaryReader(zlib.decompress(content[4:]))
+        return [self._read_srs_rule(reader) for _ in range(reader.read_uvarint())]
+
+    def _read_srs_rule(self, reader: BinaryReader) -> Dict[str, Any]:
+        rule_type = reader.read_byte()
+        if rule_type == 1:
+            mode = {0: 'and', 1: 'or'}.get(reader.read_byte())
+            if mode is None:
+                raise ValueError("未知的逻辑规则模式")
+            rule = {
+                'type': 'logical',
+                'mode': mode,
+                'rules': [self._read_srs_rule(reader) for _ in range(reader.read_uvarint())]
+            }
+            if reader.read_byte():
+                rule['invert'] = True
+            return rule
+        if rule_type != 0:
+            raise ValueError(f"未知的规则类型: {rule_type}")
+
+        items = {item_type: (key, value_type) for key, item_type, value_type in SRS_RULE_ITEMS}
+        rule = {}
+        while True:
+            item_type = reader.read_byte()
+            if item_type == SRS_ITEM_FINAL:
+                if reader.read_byte():
+                    rule['invert'] = True
+                return rule
+            if item_type not in items:
+                raise ValueError(f"不支持的规则项类型: {item_type}")
+
+            key, value_type = items[item_type]
+            if value_type == 'domain':
+                domains, suffixes = self._read_srs_domain_set(reader)
+                if domains:
+                    rule['domain'] = domains
+                if suffixes:
+                    rule['domain_suffix'] = suffixes
+            elif value_type == 'ip':
+                rule[key] = self._read_srs_ip_set(reader)
+            elif value_type == 'uint16':
+                count = reader.read_uvarint()
+                rule[key] = list(struct.unpack(f'>{count}H', reader.read(count * 2)))
+            else:
+                rule[key] = [
+                    reader.read_bytes().decode('utf-8')
+                    for _ in range(reader.read_uvarint())
+                ]
+
+    def _read_srs_domain_set(self, reader: BinaryReader) -> tuple[List[str], List[str]]:
+        """读取 succinct set 并还原为 domain / domain_suffix 列表"""
+        if reader.read_byte() != 0:
+            raise ValueError("未知的域名集合版本")
+        leaves = [reader.read_uint64() for _ in range(reader.read_uvarint())]
+        label_bitmap = [reader.read_uint64() for _ in range(reader.read_uvarint())]
+        labels = reader.read_bytes()
+
+        keys = self._succinct_set_keys(leaves, label_bitmap, labels)
+
+        domains = set()
+        raw_suffixes = set()
+        suffixes = []
+        for key in keys:
+            domain = key.decode('utf-8')[::-1]
+            if domain.startswith(SRS_DOMAIN_SUFFIX_LABEL):
+                raw_suffixes.add(domain[1:])
+            elif domain.startswith(SRS_DOMAIN_ROOT_LABEL):
+                suffixes.append(domain[1:])
+            else:
+                domains.add(domain)
+        for suffix in raw_suffixes:
+            # 旧版本规则集中 a.com 与 \r.a.com 共同表示后缀 a.com
+            if suffix.startswith('.') and suffix[1:] in domains:
+                domains.discard(suffix[1:])
+                suffixes.append(suffix[1:])
+                continue
+            suffixes.append(suffix)
+        return sorted(domains), sorted(suffixes)
+
+    def _succinct_set_keys(self, leaves: List[int], label_bitmap: List[int], labels: bytes) -> List[bytes]:
+        """按广度优先顺序还原 succinct set 中的全部键"""
+        prefixes = [b''] * (len(labels) + 1)
+        keys = []
+        node = 0
+        label_index = 0
+        for position in range(len(label_bitmap) * 64):
+            if node > len(labels):
+                break
+            if (label_bitmap[position >> 6] >> (position & 63)) & 1:
+                if (node >> 6) < len(leaves) and (leaves[node >> 6] >> (node & 63)) & 1:
+                    keys.append(prefixes[node])
+                node += 1
+                continue
+            prefixes[label_index + 1] = prefixes[node] + labels[label_index:label_index + 1]
+            label_index += 1
+        return keys
+
+    def _read_srs_ip_set(self, reader: BinaryReader) -> List[str]:
+        if reader.read_byte() != 1:
+            raise ValueError("未知的 IP 集合版本")
+        cidrs = []
+        for _ in range(reader.read_uint64()):
+            start = reader.read_bytes()
+            end = reader.read_bytes()
+            if len(start) != len(end) or len(start) not in (4, 16):
+                raise ValueError("无效的 IP 区间")
+            version = 4 if len(start) == 4 else 6
+            cidrs.extend(self._range_to_cidrs(
+                version, int.from_bytes(start, 'big'), int.from_bytes(end, 'big')
+            ))
+        return cidrs
+
     def _convert_to_mrs(self, input_path: str, output_path: str, behavior: str) -> bool:
         """将 text 规则文件转换为 mrs 格式"""
         if not self.mihomo_path:
@@ -775,9 +3350,84 @@ class RulesMerger:
             self.logger.error(f"生成 srs 过程中发生错误: {str(e)}")
             return False
 
+def lookup(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog='rule_merger.py lookup',
+        description='查询域名、IP 命中了哪些输出文件中的哪些规则, 以及这些规则来自哪些上游'
+    )
+    parser.add_argument('queries', nargs='*', help='域名、IP 或 CIDR')
+    parser.add_argument('-c', '--config', default='config.yaml', help='配置文件路径')
+    parser.add_argument('-f', '--file', help='批量查询文件, 每行一个域名、IP 或 CIDR')
+    parser.add_argument('--rebuild', action='store_true', help='忽略已持久化的索引, 重新建立')
+    parser.add_argument('--cached', action='store_true', help='直接使用已持久化的索引, 不检查输出文件与上游是否变更')
+    parser.add_argument('--refresh', action='store_true', help='重新获取上游规则源, 默认使用上次生成输出时缓存的上游内容')
+    args = parser.parse_args(argv)
+    if args.cached and args.refresh:
+        parser.error('--cached 不能与 --refresh 同时使用')
+
+    queries = list(args.queries)
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            queries.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    if not queries:
+        parser.error('缺少查询内容')
+
+    with RulesMerger(args.config) as merger:
+        index = merger.load_rule_index(rebuild=args.rebuild, cached=args.cached, refresh=args.refresh)
+    start = time.perf_counter()
+    for query in queries:
+        results = merger.lookup(index, query)
+        print(query if results else f"{query}: 未命中")
+        for result in results:
+            upstream = ', '.join(result['upstream']) if result['upstream'] else '-'
+            print(f"  {result['path']}: {result['rule']} <- {upstream}")
+    merger.logger.info(f"查询 {len(queries)} 条, 耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
 def main():
-    merger = RulesMerger('config.yaml')
-    merger.merge_rules()
+    if sys.argv[1:2] == ['lookup']:
+        lookup(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description='合并 mihomo、sing-box 规则')
+    parser.add_argument('-c', '--config', default='config.yaml', help='配置文件路径')
+    parser.add_argument('-f', '--force', action='store_true', help='忽略构建清单, 重新生成所有输出')
+    parser.add_argument('-j', '--jobs', type=int, default=OUTPUT_WORKERS, help='并发生成输出文件的线程数')
+    parser.add_argument('--parse-jobs', type=int, default=PARSE_PROCESSES, help='并行解析大规则源的进程数, 1 表示不使用进程池')
+    parser.add_argument('--large-source-size', type=float, default=LARGE_SOURCE_SIZE / (1 << 20), help='按块并行解析的规则源大小阈值 (MiB), 0 表示关闭')
+    parser.add_argument('--report', help='运行报告输出路径, 以 .csv 结尾时输出 CSV, 否则输出 JSON')
+    parser.add_argument('--profile', help='cProfile 分析结果输出路径')
+    parser.add_argument('--trace-memory', action='store_true', help='使用 tracemalloc 记录各阶段内存峰值')
+    parser.add_argument('--daemon', action='store_true', help='常驻运行, 定时刷新上游并通过 HTTP 提供输出文件')
+    parser.add_argument('--host', default=DAEMON_HOST, help='常驻模式 HTTP 服务监听地址')
+    parser.add_argument('--port', type=int, default=DAEMON_PORT, help='常驻模式 HTTP 服务端口')
+    parser.add_argument('--interval', type=float, default=DAEMON_REFRESH_INTERVAL, help='常驻模式规则源默认刷新间隔 (秒)')
+    args = parser.parse_args()
+    if args.daemon and args.report:
+        parser.error('--report 不支持与 --daemon 同时使用')
+    if args.trace_memory and not args.report:
+        parser.error('--trace-memory 需要配合 --report 使用')
+
+    merger = RulesMerger(args.config)
+    merger.output_workers = args.jobs
+    merger.parse_processes = args.parse_jobs
+    merger.large_source_size = int(args.large_source_size * (1 << 20))
+    merger.profile_path = args.profile
+    if args.report:
+        merger.report = RunReport()
+    if args.trace_memory:
+        tracemalloc.start()
+    if args.daemon:
+        merger.refresh_interval = args.interval
+        merger.run_daemon(args.host, args.port, force=args.force)
+        return
+    merger.merge_rules(force=args.force)
+    if merger.report:
+        merger.report.write(args.report)
+        merger.logger.info(f"已生成运行报告: {args.report}")
+    if merger.verify_failures:
+        merger.logger.error(f"校验失败, 未更新的输出文件: {', '.join(merger.verify_failures)}")
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()